@@ -1,10 +1,37 @@
-from collections import defaultdict
+from collections import defaultdict, deque
 import itertools
-import re
 import heapq
+import multiprocessing
 import random
 
-from src.planning_task import Operator, PlanningTask
+from src.planning_task import CompiledPlanningTask, Operator, PlanningTask
+from src.stats import timed
+
+
+# grounder shared by the processes of the pool used by Grounder._ground_actions
+_worker_grounder = None
+
+
+def _init_worker(grounder, static_predicates, initial_state):
+    global _worker_grounder
+    _worker_grounder = (grounder, static_predicates, initial_state)
+
+
+def _get_operator_tuple(op):
+    return (op.name, op.pos_preconditions, op.neg_preconditions, op.add_effects, op.del_effects)
+
+
+def _ground_shard(shard):
+    """
+    Grounds a shard (action index, parameter -> objects) and returns its
+    operators as tuples (name, pos_preconditions, neg_preconditions,
+    add_effects, del_effects), which are cheaper to send back than Operators
+    """
+    grounder, static_predicates, initial_state = _worker_grounder
+    action_idx, param2objects = shard
+    return [_get_operator_tuple(op)
+            for op in grounder._ground_action(grounder.actions[action_idx], static_predicates,
+                                              initial_state, param2objects)]
 
 
 class Grounder:
@@ -26,23 +53,47 @@ class Grounder:
         self.type2objects = problem.initial_state.objects
         self.type2objects.update(domain.constants)
 
-    def ground(self):
+    def ground(self, compiled=False, stats=None, relaxed_reachability=False, workers=1):
+        """
+        Ground the domain and the problem into a PlanningTask.
+        If compiled is True, the facts are given integer ids and
+        a CompiledPlanningTask with bitset states is returned.
+        If relaxed_reachability is True, only the operators reachable in the
+        delete relaxation are instantiated (see _ground_reachable_actions).
+        If workers > 1, the actions are grounded by a pool of worker processes,
+        except in the relaxed reachability mode.
+        The grounding time and the size of the task are added to stats if given.
+        """
+        with timed(stats, "grounding"):
+            task = self._ground_task(compiled, relaxed_reachability, workers)
+        if stats is not None:
+            stats.increment("facts", len(task.facts))
+            stats.increment("operators", len(task.operators))
+        return task
+
+    def _ground_task(self, compiled, relaxed_reachability=False, workers=1):
         # Get the static predicates
         static_predicates = self._get_static_predicates()
+        self._init_static_index(static_predicates)
 
         # Get string representation of the atoms in the initial state
         initial_state = self._get_partial_state(
             self.problem.initial_state.predicates)
 
         # Ground actions
-        operators = self._ground_actions(
-            static_predicates, initial_state)
+        if relaxed_reachability and not self._has_conditional_effects():
+            operators = self._ground_reachable_actions(
+                static_predicates, initial_state)
+        else:
+            operators = self._ground_actions(
+                static_predicates, initial_state, workers)
 
         # Ground goal
         goals = self._get_partial_state(self.problem.goals)
 
-        # get facts from operators and include the ones from the goal
-        facts = self._get_facts_from_operators(operators) | goals
+        # get facts from operators while they are generated and include the ones from the goal
+        operators, facts = self._collect_operators(operators)
+        facts |= goals
 
         # Remove static predicates from initial state
         initial_state &= facts
@@ -50,7 +101,11 @@ class Grounder:
         # remove irrelevant operators
         operators = self._remove_irrelevant_operators(operators, goals)
 
-        return PlanningTask(self.domain.name, facts, initial_state, goals, operators)
+        task = PlanningTask(self.domain.name, facts,
+                            initial_state, goals, operators)
+        if compiled:
+            return CompiledPlanningTask(task)
+        return task
 
     def _get_static_predicates(self):
         """
@@ -81,8 +136,8 @@ class Grounder:
         def is_static(predicate):
             return not any(predicate[0] == eff for eff in effects)
 
-        static_predicates = [pred[0]
-                             for pred in self.predicates if is_static(pred)]
+        static_predicates = set(pred[0]
+                                for pred in self.predicates if is_static(pred))
         return static_predicates
 
     def _get_grounded_string(self, name, args):
@@ -100,21 +155,46 @@ class Grounder:
         """Return a set of the string representation of the grounded atoms."""
         return frozenset(self._get_fact(atom) for atom in atoms)
 
-    def _find_pred_in_initial_state(self, pred_name, param, pos, initial_state):
+    def _get_atom_args(self, atom):
+        """Return the tuple of arguments of an atom"""
+        if len(atom) == 2 and atom[1] == '':
+            return ()
+        return tuple(atom[1:])
+
+    def _init_static_index(self, static_predicates):
         """
-        Check if there is an instantiation of the predicate pred_name
-        with the parameter param at position pos in the initial condition
+        Index the atoms of the static predicates in the initial state :
+        - static_facts : set of tuples (predicate name, arg1, arg2, ...)
+        - static_objects : dict (predicate name, position) -> set of the objects
+        occuring at this position
         """
-        match_in_initial_state = None
-        if pos == 0:
-            match_in_initial_state = re.compile(rf"\({pred_name} {param}.*")
-        else:
-            reg_ex = r"\(%s\s+" % pred_name
-            reg_ex += r"[\w\d-]+\s+" * pos
-            reg_ex += "{}.*".format(param)
-            match_in_initial_state = re.compile(reg_ex)
-        assert match_in_initial_state is not None
-        return any([match_in_initial_state.match(string) for string in initial_state])
+        self.static_facts = set()
+        self.static_objects = defaultdict(set)
+        self._static_preconditions = {}
+        for atom in self.problem.initial_state.predicates:
+            if atom[0] not in static_predicates:
+                continue
+            args = self._get_atom_args(atom)
+            self.static_facts.add((atom[0],) + args)
+            for pos, obj in enumerate(args):
+                self.static_objects[(atom[0], pos)].add(obj)
+
+    def _get_static_preconditions(self, action, static_predicates):
+        """
+        Return the list of triples (predicate name, arg names, is_negative)
+        of the static preconditions of an action
+        """
+        if action.name not in self._static_preconditions:
+            static_preconditions = []
+            for precondition in action.preconditions.literals:
+                is_negative = (precondition[0] == -1)
+                if is_negative:
+                    precondition = precondition[1]
+                if precondition[0] in static_predicates:
+                    static_preconditions.append(
+                        (precondition[0], self._get_atom_args(precondition), is_negative))
+            self._static_preconditions[action.name] = static_preconditions
+        return self._static_preconditions[action.name]
 
     def _get_action_signature(self, action):
         """
@@ -168,6 +248,14 @@ class Grounder:
         precondition facts. If there is a false static predicate
         in the ungrounded precondition, the operator won't be created.
         """
+        # Check the static preconditions first, with lookups in the static facts
+        for name, args, is_negative in self._get_static_preconditions(action, static_predicates):
+            key = (name,) + tuple(assignment[arg]
+                                  for arg in args if arg in assignment)
+            if (key in self.static_facts) == is_negative:
+                # the precondition will never be true, hence we don't add the operator
+                return None
+
         pos_precondition_facts = set()
         neg_precondition_facts = set()
         if action.effects.forall:
@@ -180,21 +268,16 @@ class Grounder:
             is_negative_precondition = (precondition[0] == -1)
             if is_negative_precondition:
                 precondition = precondition[1]
+            if precondition[0] in static_predicates:
+                # the static preconditions have already been checked
+                continue
             fact = self._ground_atom(precondition, assignment, action_signature
                                      )
-            predicate_name = precondition[0]
-
-            if predicate_name in static_predicates:
-                # Check if this precondition is false in the initial state
-                if (fact not in initial_state and not (is_negative_precondition)) or (fact in initial_state and is_negative_precondition):
-                    # the precondition will never be true, hence we don't add the operator
-                    return None
+            # the precondition is not always true -> we add the operator
+            if is_negative_precondition:
+                neg_precondition_facts.add(fact)
             else:
-                # the precondition is not always true -> we add the operator
-                if is_negative_precondition:
-                    neg_precondition_facts.add(fact)
-                else:
-                    pos_precondition_facts.add(fact)
+                pos_precondition_facts.add(fact)
 
         add_effects = set()
         del_effects = set()
@@ -234,9 +317,38 @@ class Grounder:
         name = self._get_grounded_string(action.name, args)
         return Operator(name, pos_precondition_facts, neg_precondition_facts, add_effects, del_effects)
 
-    def _ground_action(self, action, static_predicates, initial_state):
+    def _ground_action(self, action, static_predicates, initial_state, param2objects=None):
+        """
+        Ground the action and yield its operators, one assignment at a time.
+        param2objects restricts the objects of the parameters of the action,
+        default to the ones given by _get_param_objects.
+        """
+        if param2objects is None:
+            param2objects = self._get_param_objects(action, static_predicates)
+
+        # list of possible assignment tuples (param_name, object)
+        possible_assignments = [
+            [(param, obj) for obj in objects] for param, objects in param2objects.items()
+        ]
+
+        # Calculate all possible assignments
+        if self.custom_assigner is not None:
+            assignments = self.custom_assigner(possible_assignments)
+        else:
+            assignments = itertools.product(*possible_assignments)
+
+        # Create a new operator for each possible assignment
+        for assign in assignments:
+            op = self._create_operator(
+                action, dict(assign), static_predicates, initial_state)
+            # Filter out None values
+            if op is not None:
+                yield op
+
+    def _get_param_objects(self, action, static_predicates):
         """
-        Ground the action and return a list of operators.
+        Return a dict parameter -> set of the objects which may be assigned to
+        the parameter, according to its type and to the static preconditions.
         """
         param2objects = {}
 
@@ -274,97 +386,247 @@ class Grounder:
                             pos = count
                         count += 1
                     if pos != -1:
-                        # remove object if there is no instantiation in the initial state
-                        obj_copy = objects.copy()
-                        for o in obj_copy:
-                            is_pred_in_initial_state = self._find_pred_in_initial_state(
-                                pred[0], o, pos, initial_state)
-
-                            if (not (is_negative) and not (is_pred_in_initial_state)) or (is_negative and is_pred_in_initial_state):
-                                objects.remove(o)
-
-        # list of possible assignment tuples (param_name, object)
-        possible_assignments = [
-            [(param, obj) for obj in objects] for param, objects in param2objects.items()
-        ]
-
-        # Calculate all possible assignments
-        if self.custom_assigner is not None:
-            assignments = self.custom_assigner(possible_assignments)
-        else:
-            assignments = itertools.product(*possible_assignments)
-
-        # Create a new operator for each possible assignment
-        operators = [
-            self._create_operator(action, dict(assign), static_predicates, initial_state) for assign in assignments
-        ]
+                        objects_at_pos = self.static_objects.get(
+                            (pred[0], pos), set())
+                        if not is_negative:
+                            # remove objects without instantiation in the initial state
+                            objects &= objects_at_pos
+                        elif count == 1:
+                            # remove objects for which the unary predicate is true
+                            objects -= objects_at_pos
+
+        return param2objects
+
+    def _ground_actions(self, static_predicates, initial_state, workers=1):
+        """
+        Ground all the actions and yield their operators without duplicates,
+        so that only the operators which are kept are stored.
+        If workers > 1, the actions are split in shards grounded by a pool
+        of worker processes, and the operators are merged as the shards are done.
+        """
+        if workers <= 1:
+            seen = set()
+            for action in self.actions:
+                for op in self._ground_action(action, static_predicates, initial_state):
+                    if op not in seen:
+                        seen.add(op)
+                        yield op
+            return
+
+        shards = []
+        for action_idx, action in enumerate(self.actions):
+            # the objects are computed here since the actions with universal
+            # effects are modified by _get_param_objects
+            param2objects = self._get_param_objects(action, static_predicates)
+            shards.extend((action_idx, shard)
+                          for shard in self._split_param_objects(param2objects, 4 * workers))
+
+        seen = set()
+        with multiprocessing.Pool(workers, initializer=_init_worker,
+                                  initargs=(self, static_predicates, initial_state)) as pool:
+            for result in pool.imap(_ground_shard, shards):
+                for op in result:
+                    if op not in seen:
+                        seen.add(op)
+                        yield Operator(*op)
+
+    def _split_param_objects(self, param2objects, nb_shards):
+        """
+        Split the assignments of an action in at most nb_shards shards,
+        along the parameter with the most objects
+        """
+        if not param2objects:
+            return [param2objects]
+        param = max(param2objects, key=lambda param: len(param2objects[param]))
+        objects = sorted(param2objects[param])
+        nb_shards = max(1, min(nb_shards, len(objects)))
+        shards = []
+        for idx in range(nb_shards):
+            shard = dict(param2objects)
+            shard[param] = set(objects[idx::nb_shards])
+            shards.append(shard)
+        return shards
+
+    def _has_conditional_effects(self):
+        return any(action.effects.forall or action.effects.when for action in self.actions)
+
+    def _ground_reachable_actions(self, static_predicates, initial_state):
+        """
+        Ground only the operators which are reachable in the delete relaxation,
+        the negative preconditions being ignored, and return a list of operators.
+
+        Atoms are tuples (predicate name, arg1, arg2, ...). Starting from the
+        initial state, each newly reached atom is taken from a queue and matched
+        with the positive preconditions of the actions. The other positive
+        preconditions are then joined with the atoms reached so far, one at a
+        time, and the parameters which do not occur in them take all the objects
+        of their type. The add effects of the new operators are reached in turn.
+        """
+        schemas = []
+        # predicate -> list of (schema, index of a positive precondition)
+        triggers = defaultdict(list)
+        for action in self.actions:
+            type_objects = {param: set(self.type2objects[param_type])
+                            for param, param_type in zip(action.arg_names, action.types)}
+            # the atoms are grounded with the parameters only, as in _ground_atom
+            preconditions = [(pred[0], tuple(arg for arg in self._get_atom_args(pred)
+                                             if arg in type_objects))
+                             for pred in action.preconditions.literals if pred[0] != -1]
+            add_effects = [(effect[0], tuple(arg for arg in self._get_atom_args(effect)
+                                             if arg in type_objects))
+                           for effect in action.effects.literals if effect[0] != -1]
+            schema = (action, preconditions, add_effects, type_objects)
+            schemas.append(schema)
+            for idx, (pred, _) in enumerate(preconditions):
+                if pred not in static_predicates:
+                    triggers[pred].append((schema, idx))
+
+        # reached atoms, by predicate and by (predicate, position, object)
+        reached = defaultdict(set)
+        reached_with_arg = defaultdict(list)
+        queue = deque()
+
+        def reach(atom):
+            args = atom[1:]
+            if args in reached[atom[0]]:
+                return
+            reached[atom[0]].add(args)
+            for pos, obj in enumerate(args):
+                reached_with_arg[(atom[0], pos, obj)].append(args)
+            queue.append(atom)
+
+        def match(args, values, assignment, type_objects):
+            """Returns the assignment extended to match args with values, or None"""
+            assignment = dict(assignment)
+            for arg, value in zip(args, values):
+                if arg in assignment:
+                    if assignment[arg] != value:
+                        return None
+                elif value in type_objects[arg]:
+                    assignment[arg] = value
+                else:
+                    return None
+            return assignment
+
+        def join(preconditions, assignment, type_objects):
+            """Yields the assignments satisfying the preconditions with reached atoms"""
+            if not preconditions:
+                free_params = [param for param in type_objects
+                               if param not in assignment]
+                for values in itertools.product(*[type_objects[param] for param in free_params]):
+                    full_assignment = dict(assignment)
+                    full_assignment.update(zip(free_params, values))
+                    yield full_assignment
+                return
+            pred, args = preconditions[0]
+            candidates = reached[pred]
+            for pos, arg in enumerate(args):
+                if arg in assignment:
+                    bound = reached_with_arg.get((pred, pos, assignment[arg]), ())
+                    if len(bound) < len(candidates):
+                        candidates = bound
+            for values in list(candidates):
+                if len(values) != len(args):
+                    continue
+                extended = match(args, values, assignment, type_objects)
+                if extended is not None:
+                    yield from join(preconditions[1:], extended, type_objects)
 
-        # Filter out None values
-        operators = filter(bool, operators)
+        operators = []
+        instantiated = set()
+
+        def instantiate(schema, assignments):
+            action, _, add_effects, _ = schema
+            for assignment in assignments:
+                key = (action.name, tuple(assignment[arg]
+                                          for arg in action.arg_names))
+                if key in instantiated:
+                    continue
+                instantiated.add(key)
+                op = self._create_operator(
+                    action, assignment, static_predicates, initial_state)
+                if op is None:
+                    continue
+                operators.append(op)
+                for pred, args in add_effects:
+                    reach((pred,) + tuple(assignment[arg] for arg in args))
+
+        for atom in self.problem.initial_state.predicates:
+            reach((atom[0],) + self._get_atom_args(atom))
+        # the actions without fluent positive precondition are applicable at once
+        for schema in schemas:
+            _, preconditions, _, type_objects = schema
+            if all(pred in static_predicates for pred, _ in preconditions):
+                instantiate(schema, join(preconditions, {}, type_objects))
+
+        while queue:
+            atom = queue.popleft()
+            for schema, idx in triggers.get(atom[0], ()):
+                _, preconditions, _, type_objects = schema
+                pred, args = preconditions[idx]
+                if len(args) != len(atom) - 1:
+                    continue
+                assignment = match(args, atom[1:], {}, type_objects)
+                if assignment is None:
+                    continue
+                others = preconditions[:idx] + preconditions[idx + 1:]
+                instantiate(schema, join(others, assignment, type_objects))
 
         return operators
 
-    def _ground_actions(self, static_predicates, initial_state):
+    def _collect_operators(self, operators):
         """
-        Ground all the actions and return a list of operators.
-        """
-        op_list = [self._ground_action(action, static_predicates, initial_state)
-                   for action in self.actions]
-        grounded_operators = list(itertools.chain(*op_list))
-        return grounded_operators
-
-    def _get_facts_from_operators(self, operators):
-        """
-        Get all the facts from grounded operators (precondition, add
-        effects and delete effects).
+        Consume an iterable of operators and return the list of the operators
+        and the set of their facts, collected in the same pass.
         """
+        operator_list = []
         facts = set()
         for op in operators:
+            operator_list.append(op)
             facts |= op.pos_preconditions | op.neg_preconditions | op.add_effects | op.del_effects
-
-        return facts
+        return operator_list, facts
 
     def _remove_irrelevant_operators(self, operators, goals):
         """
-        From the facts within the goal state we iteratively compute
+        From the facts within the goal state we compute
         a fixpoint of all relevant effects.
         Relevant effects are those which contribute to a valid path to the goal.
+        The newly relevant facts are kept in a worklist, and each operator is
+        only visited when one of its effects becomes relevant, through a map
+        fact -> operators which add or delete it.
         """
-
-        relevant_facts = set()
-        old_relevant_facts = set()
-        changed = True
-        for goal in goals:
-            relevant_facts.add(goal)
-
-        while changed:
-            # set next relevant facts to current facts
-            # if nothing is added in the for loop a
-            # fixpoint has been found
-            old_relevant_facts = relevant_facts.copy()
-
-            for op in operators:
-                new_add_list = op.add_effects & relevant_facts
-                new_del_list = op.del_effects & relevant_facts
-                if new_add_list or new_del_list:
-                    # add all preconditions to the relevant facts
-                    relevant_facts |= op.pos_preconditions | op.neg_preconditions
-            changed = old_relevant_facts != relevant_facts
-
-        # delete all effects which are not relevant
-        operators_to_delete = set()
-        for op in operators:
-
-            new_add_list = op.add_effects & relevant_facts
-            new_del_list = op.del_effects & relevant_facts
-
-            op.add_effects = new_add_list
-            op.del_effects = new_del_list
-            if not new_add_list and not new_del_list:
-                operators_to_delete.add(op)
-
-        # remove completely irrelevant operators
-        return [op for op in operators if not op in operators_to_delete]
+        # indices of the operators which add or delete each fact
+        effect_of = defaultdict(list)
+        for idx, op in enumerate(operators):
+            for fact in op.add_effects:
+                effect_of[fact].append(idx)
+            for fact in op.del_effects:
+                effect_of[fact].append(idx)
+
+        relevant_facts = set(goals)
+        worklist = list(relevant_facts)
+        is_relevant = [False] * len(operators)
+        while worklist:
+            for idx in effect_of.get(worklist.pop(), ()):
+                if is_relevant[idx]:
+                    continue
+                is_relevant[idx] = True
+                op = operators[idx]
+                # add all preconditions to the relevant facts
+                for precondition in itertools.chain(op.pos_preconditions, op.neg_preconditions):
+                    if precondition not in relevant_facts:
+                        relevant_facts.add(precondition)
+                        worklist.append(precondition)
+
+        # remove completely irrelevant operators, i.e. the ones which were never
+        # reached from a relevant fact, and delete all effects which are not relevant
+        relevant_operators = []
+        for idx, op in enumerate(operators):
+            if is_relevant[idx]:
+                op.add_effects = op.add_effects & relevant_facts
+                op.del_effects = op.del_effects & relevant_facts
+                relevant_operators.append(op)
+        return relevant_operators
 
     def rubiks_partial_grounding(self):
         initial_state = self._get_partial_state(
@@ -372,6 +634,7 @@ class Grounder:
 
         # Get the static predicates
         static_predicates = self._get_static_predicates()
+        self._init_static_index(static_predicates)
 
         # Ground goal
         goals = self._get_partial_state(self.problem.goals)
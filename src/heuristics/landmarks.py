@@ -1,46 +1,164 @@
 from collections import defaultdict
-import copy
+import heapq
+import multiprocessing
 
+from src.planning_task import CompiledPlanningTask
+from src.stats import timed
 
-def _get_relaxed_task(task):
+
+class RelaxedTask:
     """
-    Removes the delete effects of the operators
+    Compact encoding of the delete relaxation of a task, where facts
+    and operators are replaced by integer ids :
+    - facts : the facts, indexed by their id
+    - initial_state, goals : lists of fact ids
+    - preconditions_count : number of positive preconditions of each operator
+    - neg_preconditions, add_effects : tuples of fact ids for each operator
+    - precondition_of : for each fact, the operators which require it
     """
-    relaxed_task = copy.deepcopy(task)
-    for op in relaxed_task.operators:
-        op.del_effects = set()
-    return relaxed_task
 
+    def __init__(self, task):
+        facts = set(task.facts) | task.initial_state | task.goals
+        for op in task.operators:
+            facts |= op.pos_preconditions | op.neg_preconditions | op.add_effects
+        self.facts = sorted(facts)
+        fact_ids = {fact: idx for idx, fact in enumerate(self.facts)}
+
+        self.initial_state = [fact_ids[fact] for fact in task.initial_state]
+        self.goals = [fact_ids[fact] for fact in task.goals]
+        self.preconditions_count = []
+        self.neg_preconditions = []
+        self.add_effects = []
+        self.precondition_of = [[] for _ in self.facts]
+        for idx, op in enumerate(task.operators):
+            self.preconditions_count.append(len(op.pos_preconditions))
+            self.neg_preconditions.append(
+                tuple(fact_ids[fact] for fact in op.neg_preconditions))
+            self.add_effects.append(
+                tuple(fact_ids[fact] for fact in op.add_effects))
+            for fact in op.pos_preconditions:
+                self.precondition_of[fact_ids[fact]].append(idx)
+
+    def is_goal_reachable_without(self, excluded, applied=None):
+        """
+        Returns True if the goals are reachable in the relaxed task without
+        applying an operator which adds the fact with id excluded.
+        If applied is a list, the operators applied during the exploration
+        are appended to it.
+
+        The exploration counts, for each operator, the preconditions which are not
+        reached yet. It follows the order of a simulation which repeatedly
+        applies the operators one after the other : an operator enabled at time t
+        is applied the next time its turn comes, and is discarded if one of
+        its negative preconditions has been reached before.
+        """
+        nb_operators = len(self.add_effects)
+        reached = bytearray(len(self.facts))
+        goals_left = len(self.goals)
+        for fact in self.initial_state:
+            reached[fact] = 1
+        for fact in self.goals:
+            goals_left -= reached[fact]
+        if not goals_left:
+            return True
+        is_goal = bytearray(len(self.facts))
+        for fact in self.goals:
+            is_goal[fact] = 1
+
+        counters = list(self.preconditions_count)
+        for fact in self.initial_state:
+            for op in self.precondition_of[fact]:
+                counters[op] -= 1
+        # heap of (application time, operator), where the time of the j-th
+        # operator during the p-th pass over the operators is p * nb_operators + j
+        agenda = [(idx, idx)
+                  for idx, count in enumerate(counters) if count == 0]
+        while agenda:
+            time, op = heapq.heappop(agenda)
+            add_effects = self.add_effects[op]
+            if excluded in add_effects:
+                continue
+            if any(reached[fact] for fact in self.neg_preconditions[op]):
+                continue
+            if applied is not None:
+                applied.append(op)
+            for fact in add_effects:
+                if reached[fact]:
+                    continue
+                reached[fact] = 1
+                if is_goal[fact]:
+                    goals_left -= 1
+                    if not goals_left:
+                        return True
+                for next_op in self.precondition_of[fact]:
+                    counters[next_op] -= 1
+                    if counters[next_op] == 0:
+                        if next_op > op:
+                            next_time = time - op + next_op
+                        else:
+                            next_time = time - op + nb_operators + next_op
+                        heapq.heappush(agenda, (next_time, next_op))
+        return False
+
+
+# relaxed task shared by the processes of the pool used by get_landmarks
+_worker_relaxed_task = None
+
+
+def _init_worker(relaxed_task):
+    global _worker_relaxed_task
+    _worker_relaxed_task = relaxed_task
+
+
+def _get_landmark_ids(fact_ids):
+    """Returns the ids of a shard of candidate facts which are landmarks"""
+    return [fact_id for fact_id in fact_ids
+            if not _worker_relaxed_task.is_goal_reachable_without(fact_id)]
 
-def get_landmarks(task):
+
+def get_landmarks(task, workers=1):
     """Returns a set of landmarks.
+    A fact is a landmark if the goals are not reachable in the relaxed task
+    without an operator which adds it.
+    If workers > 1, the candidate facts are checked by a pool of worker processes.
     """
-    # remove del effects of operators
-    task = _get_relaxed_task(task)
+    relaxed_task = RelaxedTask(task)
     landmarks = set(task.goals)
     possible_landmarks = task.facts - task.goals
+    fact_ids = {fact: idx for idx, fact in enumerate(relaxed_task.facts)}
+
+    # Excluding the facts which are not added by an operator applied
+    # during the exploration of the whole relaxed task does not change
+    # the exploration, so only the added facts have to be checked
+    applied = []
+    is_reachable = relaxed_task.is_goal_reachable_without(-1, applied)
+    added_facts = set()
+    for op in applied:
+        added_facts.update(relaxed_task.add_effects[op])
 
+    candidates = []
     for fact in possible_landmarks:
-        current_state = task.initial_state
-        # goal is reached is all of the goal facts are in the current state
-        is_goal_reached = task.goals.issubset(current_state)
-
-        while not is_goal_reached:
-            old_state = current_state
-
-            for op in task.operators:
-                # try to apply an operator to the current state
-                if op.applicable(current_state) and fact not in op.add_effects:
-                    current_state = op.apply(current_state)
-                    if task.goals.issubset(current_state):
-                        break
-            # if there is no operators which can change the state without adding the fact,
-            # this fact is necassry to reach the goal
-            if old_state == current_state and not task.goals.issubset(current_state):
-                landmarks.add(fact)
-                break
-
-            is_goal_reached = task.goals.issubset(current_state)
+        fact_id = fact_ids[fact]
+        if fact_id in added_facts:
+            candidates.append(fact_id)
+        elif not is_reachable:
+            landmarks.add(fact)
+    candidates.sort()
+
+    if workers > 1 and len(candidates) > 1:
+        # a few shards per worker to balance the load
+        nb_shards = min(len(candidates), 4 * workers)
+        shards = [candidates[idx::nb_shards] for idx in range(nb_shards)]
+        with multiprocessing.Pool(workers, initializer=_init_worker,
+                                  initargs=(relaxed_task,)) as pool:
+            results = pool.map(_get_landmark_ids, shards)
+        landmark_ids = [fact_id for result in results for fact_id in result]
+    else:
+        _init_worker(relaxed_task)
+        landmark_ids = _get_landmark_ids(candidates)
+        _init_worker(None)
+
+    landmarks.update(relaxed_task.facts[fact_id] for fact_id in landmark_ids)
     return landmarks
 
 
@@ -67,24 +185,84 @@ def get_landmark_costs(task, landmarks):
 
 
 class LandmarkHeuristic:
-    def __init__(self, task):
+    def __init__(self, task, workers=1, stats=None):
+        """
+        Arguments
+        - task : the planning task, compiled or not
+        - workers : number of processes used to compute the landmarks
+        - stats : Statistics to which the setup time is added
+        """
+        with timed(stats, "heuristic_setup"):
+            self._setup(task, workers)
+        if stats is not None:
+            stats.increment("landmarks", len(self.landmarks))
+
+    def _setup(self, task, workers):
         self.task = task
+        # with a compiled task, landmarks are computed on the original task
+        self.compiled = isinstance(task, CompiledPlanningTask)
+        source_task = task.task if self.compiled else task
 
-        self.landmarks = get_landmarks(task)
-        assert self.task.goals.issubset(self.landmarks)
-        self.costs = get_landmark_costs(task, self.landmarks)
+        self.landmarks = get_landmarks(source_task, workers=workers)
+        assert source_task.goals.issubset(self.landmarks)
+        self.costs = get_landmark_costs(source_task, self.landmarks)
+
+        # landmarks are numbered, and the landmarks not reached by a node
+        # are stored as a bitset over these numbers
+        landmarks = sorted(self.landmarks)
+        landmark_ids = {landmark: idx for idx,
+                        landmark in enumerate(landmarks)}
+        self.landmark_costs = [self.costs[landmark] for landmark in landmarks]
+
+        def get_mask(facts):
+            mask = 0
+            for fact in facts:
+                if fact in landmark_ids:
+                    mask |= 1 << landmark_ids[fact]
+            return mask
+
+        self.initial_not_reached = (
+            (1 << len(landmarks)) - 1) & ~get_mask(source_task.initial_state)
+        self.add_masks = {}
+        for op in task.operators:
+            source_op = op.operator if self.compiled else op
+            self.add_masks[id(op)] = get_mask(source_op.add_effects)
+        # pairs (goal, bit of the goal landmark), where the goal is
+        # a fact mask for compiled tasks
+        self.goal_bits = []
+        for goal in sorted(source_task.goals):
+            key = 1 << task.fact_ids[goal] if self.compiled else goal
+            self.goal_bits.append((key, 1 << landmark_ids[goal]))
+
+    def _get_unreached_goals(self, state):
+        """Returns the bitset of the goal landmarks which are false in the state"""
+        mask = 0
+        if self.compiled:
+            for key, bit in self.goal_bits:
+                if not state & key:
+                    mask |= bit
+        else:
+            for key, bit in self.goal_bits:
+                if key not in state:
+                    mask |= bit
+        return mask
 
     def __call__(self, node):
         """Returns the heuristic value for a given node"""
         if node.parent is None:
             # At first, only the initial facts are achieved
-            node.not_reached = self.landmarks - self.task.initial_state
+            node.not_reached = self.initial_not_reached
         else:
             # A new node reaches the facts in its add_effects
-            node.not_reached = node.parent.not_reached - node.action.add_effects
+            node.not_reached = node.parent.not_reached & ~self.add_masks[id(
+                node.action)]
         # The goal facts should be unreached if they are not true
         # in the current state, even if they have been reached before
-        not_reached = node.not_reached | (self.task.goals - node.state)
+        not_reached = node.not_reached | self._get_unreached_goals(node.state)
 
-        h_val = sum(self.costs[landmark] for landmark in not_reached)
+        h_val = 0
+        while not_reached:
+            lowest_bit = not_reached & -not_reached
+            h_val += self.landmark_costs[lowest_bit.bit_length() - 1]
+            not_reached ^= lowest_bit
         return h_val
@@ -1,12 +1,36 @@
+import time
 
-from src.heuristics.weighted_astar import weighted_astar_search
+from src.heuristics.weighted_astar import anytime_weighted_astar_search, weighted_astar_search
 from src.grounder import Grounder
 import src.pddlparser as pddlparser
 from src.heuristics.landmarks import LandmarkHeuristic
+from src.heuristics.open_lists import get_open_list
+from src.mutexes import get_h2_mutexes, remove_mutex_operators
+from src.planning_task import CompiledPlanningTask
+from src.stats import Statistics, timed
+
+
+def print_plan(task, plan, t0, f):
+    """Prints a plan and checks that it reaches the goal"""
+    print('A plan was found. Ellapsed time : {}'.format(time.time()-t0))
+    print('A plan was found. Ellapsed time : {}'.format(
+        time.time()-t0), file=f)
+    print('Oprerators of the plan : ')
+    state = task.initial_state
+    for op in plan:
+        print(op)
+        print(op, file=f)
+        print("========================================================",
+              file=f)
+        print("\n", file=f)
+        if op.applicable(state):
+            state = op.apply(state)
+    f.flush()
+    assert task.is_goal_reached(state), "solution not valid"
+
 
 if __name__ == '__main__':
     import argparse
-    import time
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--domain_file", help="path to the pddl domain file", required=True)
@@ -14,41 +38,83 @@ if __name__ == '__main__':
         "--problem_file", help="path to the pddl problem file", required=True)
     parser.add_argument("--partial_grounding",
                         help="whether to use or not partial grounding", default=0)
+    parser.add_argument("--relaxed_grounding",
+                        help="whether to ground or not only the operators reachable in the delete relaxation",
+                        default=0)
+    parser.add_argument("--grounding_workers",
+                        help="number of processes used to ground the actions, default to 1", default=1)
+    parser.add_argument("--compiled",
+                        help="whether to use or not integer facts and bitset states", default=0)
     parser.add_argument(
         '--weight', help="weight used in weighted A* search, default to 5", default=5)
+    parser.add_argument("--anytime",
+                        help="whether to use or not restarting weighted A* with decreasing weights", default=0)
+    parser.add_argument(
+        "--weights", help="comma separated weights of the anytime search, default to 5,3,2,1.5,1",
+        default="5,3,2,1.5,1")
+    parser.add_argument("--mutexes",
+                        help="whether to remove or not the operators with h2 mutex preconditions", default=0)
+    parser.add_argument(
+        "--workers", help="number of processes used to compute the landmarks, default to 1", default=1)
+    parser.add_argument(
+        "--lazy", help="whether to use or not deferred heuristic evaluation", default=0)
+    parser.add_argument(
+        "--open_list", help="open list used by the search, heap or bucket, default to heap",
+        choices=["heap", "bucket"], default="heap")
     parser.add_argument(
         "--output_file", help="path to the file to store the outputs", default="benchmark_results.txt")
+    parser.add_argument(
+        "--stats_file", help="path to a json file to store the statistics of the run", default=None)
     args = parser.parse_args()
 
     f = open(args.output_file, 'a')
     print('Using A* planner with landmarks heuristic ... ')
     print('Using A* planner with landmarks heuristic', file=f)
     t0 = time.time()
-    domain = pddlparser.PDDLParser.parse(args.domain_file)
-    problem = pddlparser.PDDLParser.parse(args.problem_file)
+    stats = Statistics()
+    domain = pddlparser.PDDLParser.parse(args.domain_file, stats=stats)
+    problem = pddlparser.PDDLParser.parse(args.problem_file, stats=stats)
     grounder = Grounder(domain, problem)
 
     if args.partial_grounding:
         print('Using partial grounding')
         task = grounder.rubiks_partial_grounding()
+        if int(args.compiled):
+            task = CompiledPlanningTask(task)
     else:
         print('Using classical grounding')
-        task = grounder.ground()
-
-    plan = weighted_astar_search(
-        task, heuristic=LandmarkHeuristic(task), weight=5)
-    if plan:
-        print('A plan was found. Ellapsed time : {}'.format(time.time()-t0))
-        print('A plan was found. Ellapsed time : {}'.format(
-            time.time()-t0), file=f)
-        print('Oprerators of the plan : ')
-        state = task.initial_state
-        for op in plan:
-            print(op)
-            print(op, file=f)
-            print("========================================================",
-                  file=f)
-            print("\n", file=f)
-            if op.applicable(state):
-                state = op.apply(state)
-        assert task.goals.issubset(state), "solution not valid"
+        task = grounder.ground(compiled=bool(int(args.compiled)), stats=stats,
+                               relaxed_reachability=bool(int(args.relaxed_grounding)),
+                               workers=int(args.grounding_workers))
+
+    if int(args.mutexes):
+        compiled = isinstance(task, CompiledPlanningTask)
+        source_task = task.task if compiled else task
+        with timed(stats, "mutexes"):
+            mutexes = get_h2_mutexes(source_task)
+            source_task = remove_mutex_operators(source_task, mutexes)
+        stats.increment("mutexes", len(mutexes))
+        print('{} operators left after removing the operators with mutex preconditions'.format(
+            len(source_task.operators)))
+        task = CompiledPlanningTask(source_task) if compiled else source_task
+
+    heuristic = LandmarkHeuristic(
+        task, workers=int(args.workers), stats=stats)
+    if int(args.anytime):
+        weights = [float(weight) for weight in args.weights.split(',')]
+        plans = anytime_weighted_astar_search(
+            task, heuristic, weights=weights,
+            make_open_list=lambda: get_open_list(args.open_list), lazy=bool(int(args.lazy)),
+            stats=stats)
+        for plan in plans:
+            print_plan(task, plan, t0, f)
+    else:
+        plan = weighted_astar_search(
+            task, heuristic=heuristic, weight=float(args.weight),
+            open_list=get_open_list(args.open_list), lazy=bool(int(args.lazy)),
+            stats=stats)
+        if plan:
+            print_plan(task, plan, t0, f)
+
+    if args.stats_file:
+        stats.dump(args.stats_file)
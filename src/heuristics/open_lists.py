@@ -0,0 +1,83 @@
+from collections import deque
+import heapq
+
+
+class HeapOpenList:
+    """
+    Open list backed by a binary heap. Entries are ordering tuples
+    (f, h, preference, ...) and are popped in lexicographic order.
+    """
+
+    def __init__(self):
+        self.heap = []
+
+    def push(self, entry):
+        heapq.heappush(self.heap, entry)
+
+    def pop(self):
+        return heapq.heappop(self.heap)
+
+    def __len__(self):
+        return len(self.heap)
+
+
+class BucketOpenList:
+    """
+    Bucket queue for entries (f, h, preference, ...).
+    Entries are grouped in buckets keyed on (f, h) quantized with
+    the given granularity, and are popped in FIFO order inside a bucket,
+    i.e. by increasing preference.
+    Since the heuristic values only take a small number of distinct
+    values, pushing an entry in an existing bucket and popping an entry are O(1).
+    The keys of the non-empty buckets are kept in a heap to find the minimum one.
+    Infinite values are not quantized, so that they get their own buckets
+    after all the finite ones.
+    """
+
+    def __init__(self, granularity=1000):
+        """
+        Arguments
+        - granularity : the keys of an entry are round(f * granularity) and
+        round(h * granularity)
+        """
+        self.granularity = granularity
+        self.buckets = {}
+        self.keys = []
+        self.size = 0
+
+    def _quantize(self, value):
+        if value == float("inf"):
+            return value
+        return round(value * self.granularity)
+
+    def push(self, entry):
+        key = (self._quantize(entry[0]), self._quantize(entry[1]))
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = deque()
+            self.buckets[key] = bucket
+            heapq.heappush(self.keys, key)
+        bucket.append(entry)
+        self.size += 1
+
+    def pop(self):
+        key = self.keys[0]
+        bucket = self.buckets[key]
+        entry = bucket.popleft()
+        if not bucket:
+            heapq.heappop(self.keys)
+            del self.buckets[key]
+        self.size -= 1
+        return entry
+
+    def __len__(self):
+        return self.size
+
+
+def get_open_list(name):
+    """Returns a new open list from its name ("heap" or "bucket")"""
+    if name == "heap":
+        return HeapOpenList()
+    if name == "bucket":
+        return BucketOpenList()
+    raise ValueError("Unknown open list : {}".format(name))
@@ -1,48 +1,259 @@
-class SearchNode:
+from array import array
+import random
+
+from src.planning_task import CompiledPlanningTask
+
+
+class ZobristHasher:
     """
-    Each search node has a parent node and contains informations about 
-    - the state 
-    - the actions to apply to reach the node
-    - the path length to reach the node
+    Zobrist hashing of states : each fact is given a random 64-bit key
+    and the hash of a state is the xor of the keys of its facts.
+    The hash of a successor is computed from the hash of its parent by
+    xoring the keys of the facts changed by the operator.
     """
 
-    def __init__(self, state, parent, action, g):
-        """
-        Arguments
+    def __init__(self, task, seed=0):
+        self.compiled = isinstance(task, CompiledPlanningTask)
+        rng = random.Random(seed)
+        self.keys = {fact: rng.getrandbits(64) for fact in sorted(task.facts)}
+        if self.compiled:
+            # keys indexed by fact id, and for each operator, pairs
+            # (fact mask, key) of its add and delete effects
+            self.fact_keys = [self.keys[fact] for fact in task.facts]
+            self.effect_keys = {}
+            for op in task.operators:
+                self.effect_keys[id(op)] = (
+                    self._get_mask_keys(op.add_mask),
+                    self._get_mask_keys(op.del_mask),
+                )
+
+    def _get_mask_keys(self, mask):
+        pairs = []
+        while mask:
+            bit = mask & -mask
+            pairs.append((bit, self.fact_keys[bit.bit_length() - 1]))
+            mask ^= bit
+        return pairs
+
+    def get_hash(self, state):
+        """Returns the hash of a state"""
+        state_hash = 0
+        if self.compiled:
+            for _, key in self._get_mask_keys(state):
+                state_hash ^= key
+        else:
+            for fact in state:
+                state_hash ^= self.keys[fact]
+        return state_hash
 
-        - state: The state
-        - parent: The parent node
-        - action: The action which led to the state
-        - g : The path length to reach the node
+    def get_successor_hash(self, state_hash, state, op):
         """
-        self.state = state
-        self.parent = parent
-        self.action = action
-        self.g = g
+        Returns the hash of the state obtained by applying op in state,
+        where state_hash is the hash of state
+        """
+        if self.compiled:
+            add_keys, del_keys = self.effect_keys[id(op)]
+            for bit, key in del_keys:
+                if state & bit:
+                    state_hash ^= key
+            for bit, key in add_keys:
+                if not state & bit:
+                    state_hash ^= key
+        else:
+            keys = self.keys
+            for fact in op.del_effects:
+                if fact in state:
+                    state_hash ^= keys[fact]
+            for fact in op.add_effects:
+                if fact not in state:
+                    state_hash ^= keys[fact]
+        return state_hash
 
-    def extract_solution(self):
+
+class StateRegistry:
+    """
+    Interns the states met during the search : each distinct state is stored
+    once and identified by an integer id.
+    States are looked up by their 64-bit hash, and full states are only
+    compared when a state with the same hash has already been registered.
+    """
+
+    def __init__(self):
+        # hash -> state id, or list of state ids if different states have the same hash
+        self.state_ids = {}
+        self.states = []
+        self.hashes = array('Q')
+
+    def _add_state(self, state, state_hash):
+        state_id = len(self.states)
+        self.states.append(state)
+        self.hashes.append(state_hash)
+        return state_id
+
+    def insert_state(self, state, state_hash):
         """
-        Returns the list of actions that were applied from the initial node to
-        the goal node.
+        Returns the id of a state, registering it if it has not been seen before
         """
-        sol = []
-        while self.parent is not None:
-            sol.append(self.action)
-            self = self.parent
-        sol.reverse()
-        print('Found plan with {} actions'.format(len(sol)))
-        return sol
+        entry = self.state_ids.get(state_hash)
+        if entry is None:
+            state_id = self._add_state(state, state_hash)
+            self.state_ids[state_hash] = state_id
+            return state_id
+        if type(entry) is int:
+            if self.states[entry] == state:
+                return entry
+            entry = [entry]
+            self.state_ids[state_hash] = entry
+        for state_id in entry:
+            if self.states[state_id] == state:
+                return state_id
+        state_id = self._add_state(state, state_hash)
+        entry.append(state_id)
+        return state_id
 
+    def lookup_state(self, state_id):
+        return self.states[state_id]
 
-def make_root_node(initial_state):
+    def __len__(self):
+        return len(self.states)
+
+
+class SearchSpace:
     """
-    Construct the root node.
+    Stores the search information of every registered state in parallel
+    arrays indexed by the state id :
+    - parents : id of the parent state (-1 for the root)
+    - operator_ids : index in task.operators of the operator which led to the state
+    - g : the path length to reach the state
+    - search_ids : the search in which parents, operator_ids and g were set
+    - h : the cached heuristic value of the state, or None
+    - not_reached : the landmarks not reached yet, as set by the heuristic
+
+    The same search space can be used by successive searches (see new_search) :
+    the states and their heuristic values are kept, while the paths are reset.
     """
-    return SearchNode(initial_state, None, None, 0)
 
+    def __init__(self, task):
+        self.registry = StateRegistry()
+        self.hasher = ZobristHasher(task)
+        self.operators = list(task.operators)
+        self.operator_indices = {id(op): idx for idx,
+                                 op in enumerate(self.operators)}
+        self.parents = array('l')
+        self.operator_ids = array('l')
+        self.g = array('l')
+        self.search_ids = array('l')
+        self.search_id = 0
+        self.h = []
+        self.not_reached = []
+
+    def new_search(self):
+        """
+        Start a new search : the paths found by the previous searches are forgotten
+        """
+        self.search_id += 1
+
+    def _set_info(self, state_id, parent_id, operator_id, g):
+        if state_id == len(self.g):
+            self.parents.append(parent_id)
+            self.operator_ids.append(operator_id)
+            self.g.append(g)
+            self.search_ids.append(self.search_id)
+            self.h.append(None)
+            self.not_reached.append(None)
+        else:
+            self.parents[state_id] = parent_id
+            self.operator_ids[state_id] = operator_id
+            self.g[state_id] = g
+            self.search_ids[state_id] = self.search_id
 
-def make_child_node(parent, action, state):
+    def make_root_node(self, initial_state):
+        """
+        Construct the root node.
+        """
+        state_id = self.registry.insert_state(
+            initial_state, self.hasher.get_hash(initial_state))
+        self._set_info(state_id, -1, -1, 0)
+        return SearchNode(self, state_id)
+
+    def make_child_node(self, parent, action, state):
+        """
+        Register a state reached by applying action in the state of parent.
+        Returns the node of the state, or None if a path which is
+        at least as cheap to this state is already known.
+        """
+        registry = self.registry
+        state_hash = self.hasher.get_successor_hash(
+            registry.hashes[parent.state_id], registry.states[parent.state_id], action)
+        state_id = registry.insert_state(state, state_hash)
+        g = self.g[parent.state_id] + 1
+        if (state_id < len(self.g) and self.search_ids[state_id] == self.search_id
+                and self.g[state_id] <= g):
+            return None
+        self._set_info(state_id, parent.state_id,
+                       self.operator_indices[id(action)], g)
+        return SearchNode(self, state_id)
+
+    def get_node(self, state_id):
+        return SearchNode(self, state_id)
+
+
+class SearchNode:
     """
-    Construct a new search node containing the state and the applied action.
+    A view on the information stored by a SearchSpace for a state :
+    - the state
+    - the parent node
+    - the action applied to reach the node
+    - the path length to reach the node
     """
-    return SearchNode(state, parent, action, parent.g + 1)
+
+    __slots__ = ("space", "state_id")
+
+    def __init__(self, space, state_id):
+        self.space = space
+        self.state_id = state_id
+
+    @property
+    def state(self):
+        return self.space.registry.lookup_state(self.state_id)
+
+    @property
+    def parent(self):
+        parent_id = self.space.parents[self.state_id]
+        if parent_id == -1:
+            return None
+        return SearchNode(self.space, parent_id)
+
+    @property
+    def action(self):
+        operator_id = self.space.operator_ids[self.state_id]
+        if operator_id == -1:
+            return None
+        return self.space.operators[operator_id]
+
+    @property
+    def g(self):
+        return self.space.g[self.state_id]
+
+    @property
+    def not_reached(self):
+        return self.space.not_reached[self.state_id]
+
+    @not_reached.setter
+    def not_reached(self, value):
+        self.space.not_reached[self.state_id] = value
+
+    def extract_solution(self):
+        """
+        Returns the list of actions that were applied from the initial node to
+        the goal node.
+        """
+        space = self.space
+        sol = []
+        state_id = self.state_id
+        while space.parents[state_id] != -1:
+            sol.append(space.operators[space.operator_ids[state_id]])
+            state_id = space.parents[state_id]
+        sol.reverse()
+        print('Found plan with {} actions'.format(len(sol)))
+        return sol
@@ -0,0 +1,46 @@
+import os
+
+from src.grounder import Grounder
+import src.pddlparser as pddlparser
+from src.heuristics.landmarks import get_landmarks
+
+INSTANCES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instances')
+domain_file = os.path.join(INSTANCES, 'groupe2', 'domain.pddl')
+problem_file = os.path.join(INSTANCES, 'groupe2', 'problem1.pddl')
+
+
+def get_simulated_landmarks(task):
+    """
+    Landmarks computed by simulating the relaxed task without each fact,
+    applying the operators in the order of task.operators
+    """
+    landmarks = set(task.goals)
+    for fact in task.facts - task.goals:
+        current_state = task.initial_state
+        while not task.goals.issubset(current_state):
+            old_state = current_state
+            for op in task.operators:
+                if op.applicable(current_state) and fact not in op.add_effects:
+                    # the delete effects are ignored
+                    current_state = current_state | op.add_effects
+                    if task.goals.issubset(current_state):
+                        break
+            if old_state == current_state:
+                landmarks.add(fact)
+                break
+    return landmarks
+
+
+def test_landmarks():
+    domain = pddlparser.PDDLParser.parse(domain_file)
+    problem = pddlparser.PDDLParser.parse(problem_file)
+    task = Grounder(domain, problem).ground()
+
+    landmarks = get_simulated_landmarks(task)
+    assert get_landmarks(task) == landmarks
+    assert get_landmarks(task, workers=2) == landmarks
+
+
+if __name__ == '__main__':
+    test_landmarks()
+    print('landmarks OK')
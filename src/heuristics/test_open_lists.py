@@ -0,0 +1,20 @@
+from src.heuristics.open_lists import BucketOpenList, HeapOpenList
+
+INF = float("inf")
+
+
+def test_open_lists_order():
+    # entries (f, h, preference, state_id, g), including dead ends with an infinite h
+    entries = [(3, 1, 0, 0, 2), (INF, INF, 1, 1, 0), (2.5, 0.5, 2, 2, 2),
+               (3, 1, 3, 3, 2), (INF, INF, 4, 4, 1)]
+    for open_list in (HeapOpenList(), BucketOpenList()):
+        for entry in entries:
+            open_list.push(entry)
+        popped = [open_list.pop() for _ in range(len(entries))]
+        assert not open_list
+        assert popped == sorted(entries), popped
+
+
+if __name__ == '__main__':
+    test_open_lists_order()
+    print('open lists OK')
@@ -1,5 +1,7 @@
+import time
+
 import search_node
-import heapq
+import open_lists
 
 
 def ordered_node_weighted_astar(weight):
@@ -10,72 +12,181 @@ def ordered_node_weighted_astar(weight):
     - h : The heuristic value
     - node_preference : a value which represents preference for nodes inserted first
     if the oredrings are equal.
+    The node is stored as its state id and its path length, which is used
+    to recognize entries made obsolete by a cheaper path to the same state.
     """
     return lambda node, h, node_preference: (
         node.g + weight * h,
         h,
         node_preference,
-        node,
+        node.state_id,
+        node.g,
     )
 
 
 def weighted_astar_search(
-    task, heuristic, weight=5
+    task, heuristic, weight=5, open_list=None, lazy=False, space=None, bound=float("inf"), stats=None
 ):
     """
     Searches for a plan using weighted A* search.
     Arguments 
     - task : the PDDL task
     - heuristic : A heuristic to estimate the number of steps from a node to the goal
+    - open_list : the open list to use (see open_lists), default to a HeapOpenList
+    - lazy : if True, use deferred evaluation : the children of a node are queued
+    with the heuristic value of their parent, and are evaluated when they are popped
+    - space : a SearchSpace used by previous searches on the same task, whose
+    heuristic values are reused
+    - bound : only plans with less than bound actions are searched for
+    - stats : Statistics to which the search time, the heuristic time, the numbers of
+    generated, duplicate, evaluated and expanded nodes and the peak size of
+    the open list are added
     """
-    open = []
-    state_cost = {task.initial_state: 0}
+    t0 = time.perf_counter()
+    if open_list is None:
+        open_list = open_lists.HeapOpenList()
+    if space is None:
+        space = search_node.SearchSpace(task)
+    else:
+        space.new_search()
     node_preference = 0
+    nb_evaluations = 0
+    heuristic_time = 0
+
+    def evaluate(node):
+        nonlocal nb_evaluations, heuristic_time
+        # the heuristic value of a state is computed only once
+        h_val = space.h[node.state_id]
+        if h_val is None:
+            if stats is None:
+                h_val = heuristic(node)
+            else:
+                t_h = time.perf_counter()
+                h_val = heuristic(node)
+                heuristic_time += time.perf_counter() - t_h
+            nb_evaluations += 1
+            space.h[node.state_id] = h_val
+        return h_val
 
     # construct root node
-    root = search_node.make_root_node(task.initial_state)
-    init_h_val = heuristic(root)
+    root = space.make_root_node(task.initial_state)
+    init_h_val = evaluate(root)
     # create new search node and ordering
-    heapq.heappush(open, ordered_node_weighted_astar(weight)(
+    open_list.push(ordered_node_weighted_astar(weight)(
         root, init_h_val, node_preference))
 
     min_h = float("inf")
     count = 0
     nb_expansions = 0
+    nb_generated = 0
+    nb_duplicates = 0
+    peak_open_list_size = len(open_list)
+    plan = None
 
-    while open:
-        (f, h_val, preference, node) = heapq.heappop(open)
-        if h_val < min_h:
-            min_h = h_val
-            print("Found new best h value ({}) after {} expansions".format(min_h, count))
+    while open_list:
+        (f, h_val, preference, state_id, g) = open_list.pop()
 
-        state = node.state
         # expand the node if its cost g is the min cost for this state.
         # Else, a cheaper path has been found
-        if state_cost[state] == node.g:
+        if space.g[state_id] == g:
+            node = space.get_node(state_id)
+            if lazy:
+                # the node was queued with the heuristic value of its parent
+                h_val = evaluate(node)
+            if h_val < min_h:
+                min_h = h_val
+                print("Found new best h value ({}) after {} expansions".format(
+                    min_h, count))
+            if h_val == float("inf"):
+                # can't reach the goal
+                count += 1
+                continue
+
             nb_expansions += 1
+            state = node.state
 
-            if task.is_goal_reached(state):
+            # a plan is only accepted if it is shorter than bound
+            if g < bound and task.is_goal_reached(state):
                 print("Goal reached, extracting solution ...")
-                return node.extract_solution()
+                plan = node.extract_solution()
+                break
+
+            # the children of the node can not lead to a plan shorter than bound
+            if g + 1 >= bound:
+                count += 1
+                continue
 
             for op, next_state in task.get_next_states(state):
+                nb_generated += 1
 
-                next_node = search_node.make_child_node(
-                    node, op, next_state)
-                h_val = heuristic(next_node)
-                if h_val == float("inf"):
-                    # can't reach the goal
+                # the child is None if we already reached next state
+                # with a path which is at least as cheap
+                next_node = space.make_child_node(node, op, next_state)
+                if next_node is None:
+                    nb_duplicates += 1
                     continue
-                old_next_g = state_cost.get(next_state, float("inf"))
-                if next_node.g < old_next_g:
-                    # this means that we either visited next state before
-                    # or found a cheaper path to this sate
-                    node_preference += 1
-                    heapq.heappush(open, ordered_node_weighted_astar(weight)(
-                        next_node, h_val, node_preference))
-                    state_cost[next_state] = next_node.g
+                if lazy:
+                    next_h_val = h_val
+                else:
+                    next_h_val = evaluate(next_node)
+                    if next_h_val == float("inf"):
+                        # can't reach the goal
+                        continue
+                node_preference += 1
+                open_list.push(ordered_node_weighted_astar(weight)(
+                    next_node, next_h_val, node_preference))
+            if len(open_list) > peak_open_list_size:
+                peak_open_list_size = len(open_list)
 
         count += 1
-    print("Task unsolvable : no operators left")
-    return None
+
+    if plan is None:
+        if bound == float("inf"):
+            print("Task unsolvable : no operators left")
+        else:
+            print("No plan with less than {} actions".format(bound))
+    if stats is not None:
+        stats.add_time("search", time.perf_counter() - t0)
+        stats.add_time("heuristic", heuristic_time)
+        stats.increment("searches")
+        stats.increment("generated", nb_generated)
+        stats.increment("duplicates", nb_duplicates)
+        stats.increment("evaluated", nb_evaluations)
+        stats.increment("expanded", nb_expansions)
+        stats.update_max("peak_open_list_size", peak_open_list_size)
+    return plan
+
+
+def anytime_weighted_astar_search(
+    task, heuristic, weights=(5, 3, 2, 1.5, 1), make_open_list=open_lists.HeapOpenList, lazy=False,
+    stats=None
+):
+    """
+    Restarting weighted A* search : a first plan is searched for with
+    the first weight, then the search is restarted with the next weights,
+    only looking for plans shorter than the best one found so far.
+    The heuristic values computed by a search are reused by the next ones.
+    This is a generator which yields every improved plan as soon as it is found.
+    Arguments
+    - task : the PDDL task
+    - heuristic : A heuristic to estimate the number of steps from a node to the goal
+    - weights : the decreasing weights of the successive searches
+    - make_open_list : function returning a new open list for each search
+    - lazy : whether to use deferred evaluation
+    - stats : Statistics accumulating the statistics of all the searches
+    """
+    space = search_node.SearchSpace(task)
+    bound = float("inf")
+    for weight in weights:
+        print("Searching for a plan with less than {} actions with weight {} ...".format(
+            bound, weight))
+        plan = weighted_astar_search(
+            task, heuristic, weight, make_open_list(), lazy, space, bound, stats)
+        if plan is None:
+            # the search is complete, hence there is no shorter plan
+            return
+        bound = len(plan)
+        yield plan
+        if bound == 0:
+            # the empty plan can not be improved
+            return
@@ -0,0 +1,110 @@
+from src.planning_task import PlanningTask
+
+
+def get_h2_mutexes(task):
+    """
+    Returns the h2 mutexes of a task, as a set of frozensets {fact1, fact2}
+    such that no reachable state contains both facts.
+
+    The pairs of facts reachable from the initial state are computed with the h2
+    reachability fixpoint (Haslum and Geffner, Admissible heuristics for optimal
+    planning, 2000) : an operator is applicable if its preconditions and their
+    pairs are reachable, then its add effects and their pairs are reachable, and so
+    are the pairs of an add effect and a fact q which is not in the effects of the
+    operator and is reachable together with the preconditions.
+    The negative preconditions are ignored, which only makes more pairs reachable.
+    The reachable pairs containing a fact are stored as a bitset over the fact ids.
+    """
+    facts = set(task.facts) | task.initial_state | task.goals
+    for op in task.operators:
+        facts |= op.pos_preconditions | op.add_effects | op.del_effects
+    facts = sorted(facts)
+    fact_ids = {fact: idx for idx, fact in enumerate(facts)}
+
+    def get_mask(facts):
+        mask = 0
+        for fact in facts:
+            mask |= 1 << fact_ids[fact]
+        return mask
+
+    operators = []
+    for op in task.operators:
+        operators.append((get_mask(op.pos_preconditions),
+                          [fact_ids[fact]
+                              for fact in op.pos_preconditions],
+                          [fact_ids[fact] for fact in op.add_effects],
+                          get_mask(op.add_effects | op.del_effects)))
+
+    # pairs[f] is the bitset of the facts g such that {f, g} is reachable,
+    # and a fact f is reachable if f is in pairs[f]
+    initial_mask = get_mask(task.initial_state)
+    pairs = [0] * len(facts)
+    for fact in task.initial_state:
+        pairs[fact_ids[fact]] = initial_mask
+    reachable = initial_mask
+
+    changed = True
+    while changed:
+        changed = False
+        for pre_mask, preconditions, add_effects, effects_mask in operators:
+            if pre_mask & reachable != pre_mask:
+                continue
+            # facts reachable together with all the preconditions
+            candidates = reachable
+            for fact_id in preconditions:
+                candidates &= pairs[fact_id]
+                if candidates & pre_mask != pre_mask:
+                    break
+            else:
+                add_mask = 0
+                for fact_id in add_effects:
+                    add_mask |= 1 << fact_id
+                # the add effects are reachable with each other and with the
+                # facts reachable together with the preconditions which are not
+                # in the effects of the operator
+                candidates = (candidates & ~effects_mask) | add_mask
+                for fact_id in add_effects:
+                    new_pairs = candidates & ~pairs[fact_id]
+                    if not new_pairs:
+                        continue
+                    changed = True
+                    pairs[fact_id] |= new_pairs
+                    reachable |= 1 << fact_id
+                    bit = 1 << fact_id
+                    while new_pairs:
+                        lowest_bit = new_pairs & -new_pairs
+                        pairs[lowest_bit.bit_length() - 1] |= bit
+                        new_pairs ^= lowest_bit
+
+    mutexes = set()
+    for fact_id, fact in enumerate(facts):
+        # the pairs with unreachable facts are not mutexes
+        not_pairs = reachable & ~pairs[fact_id] & ~((1 << (fact_id + 1)) - 1)
+        if not reachable & (1 << fact_id):
+            continue
+        while not_pairs:
+            lowest_bit = not_pairs & -not_pairs
+            mutexes.add(frozenset(
+                (fact, facts[lowest_bit.bit_length() - 1])))
+            not_pairs ^= lowest_bit
+    return mutexes
+
+
+def remove_mutex_operators(task, mutexes):
+    """
+    Returns a copy of the task without the operators whose preconditions contain
+    a mutex pair, since they are not applicable in any reachable state
+    """
+    mutex_facts = {}
+    for mutex in mutexes:
+        fact1, fact2 = mutex
+        mutex_facts.setdefault(fact1, set()).add(fact2)
+        mutex_facts.setdefault(fact2, set()).add(fact1)
+
+    def has_mutex_preconditions(op):
+        return any(not mutex_facts[fact].isdisjoint(op.pos_preconditions)
+                   for fact in op.pos_preconditions if fact in mutex_facts)
+
+    operators = set(op for op in task.operators
+                    if not has_mutex_preconditions(op))
+    return PlanningTask(task.name, task.facts, task.initial_state, task.goals, operators)
@@ -20,6 +20,7 @@ import io
 
 import src.domain as domain
 import src.problem as problem
+from src.stats import timed
 
 tokens = (
     'NAME',
@@ -764,9 +765,14 @@ yacc.yacc()
 class PDDLParser(object):
 
     @classmethod
-    def parse(cls, filename):
-        data = cls.__read_input(filename)
-        return yacc.parse(data, tracking=True)
+    def parse(cls, filename, stats=None):
+        """
+        Parses a domain or problem file. The parsing time is added
+        to stats if given.
+        """
+        with timed(stats, "parsing"):
+            data = cls.__read_input(filename)
+            return yacc.parse(data, tracking=True)
 
     @classmethod
     def __read_input(cls, filename):
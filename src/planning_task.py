@@ -1,3 +1,6 @@
+from src.successor_generator import BitsetSuccessorGenerator, SuccessorGenerator
+
+
 class Operator:
     """
     The preconditions are the facts that must be true
@@ -74,6 +77,14 @@ class PlanningTask:
         self.initial_state = initial_state
         self.goals = goals
         self.operators = operators
+        self._successor_generator = None
+
+    @property
+    def successor_generator(self):
+        """The successor generator, built from the operators on first use"""
+        if self._successor_generator is None:
+            self._successor_generator = SuccessorGenerator(self.operators)
+        return self._successor_generator
 
     def is_goal_reached(self, state):
         return self.goals.issubset(state)
@@ -83,7 +94,7 @@ class PlanningTask:
         Returns a list of (op, new_state) pairs where "op" is an applicable
         operator and "new_state" is the state obtained after applying op in new_state
         """
-        return [(op, op.apply(state)) for op in self.operators if op.applicable(state)]
+        return self.successor_generator.get_next_states(state)
 
     def __str__(self):
         str_repr = "Task {0}\n  Facts:  {1}\n  Initial state:  {2}\n  Goals: {3}\n  Operators:   {4}"
@@ -98,3 +109,112 @@ class PlanningTask:
     def __repr__(self):
         string = "<Task {0}, num_facts: {1}, num_operators: {2}>"
         return string.format(self.name, len(self.facts), len(self.operators))
+
+
+class CompiledOperator:
+    """
+    An operator whose facts are encoded as bitmasks over the fact ids
+    of a CompiledPlanningTask.
+    pre_mask and neg_mask are the positive and negative preconditions,
+    add_mask and del_mask the add and delete effects.
+    """
+
+    def __init__(self, operator, fact_ids):
+        """
+        Parameters :
+        - operator : the grounded Operator to compile
+        - fact_ids : dictionnary fact -> integer id
+        """
+        self.operator = operator
+        self.name = operator.name
+        self.pre_mask = facts_to_mask(operator.pos_preconditions, fact_ids)
+        self.neg_mask = facts_to_mask(operator.neg_preconditions, fact_ids)
+        self.add_mask = facts_to_mask(operator.add_effects, fact_ids)
+        self.del_mask = facts_to_mask(operator.del_effects, fact_ids)
+
+    def applicable(self, state):
+        """
+        Operators are applicable when all the bits of their preconditions
+        are set in the state and none of the bits of their negative preconditions are.
+        """
+        return state & self.pre_mask == self.pre_mask and not state & self.neg_mask
+
+    def apply(self, state):
+        """
+        Apply the operator in a given state
+        """
+        assert self.applicable(state)
+        return (state & ~self.del_mask) | self.add_mask
+
+    def __str__(self):
+        return str(self.operator)
+
+    def __repr__(self):
+        return "<CompiledOperator %s>" % self.name
+
+
+def facts_to_mask(facts, fact_ids):
+    """
+    Returns the bitmask of a set of facts
+    """
+    mask = 0
+    for fact in facts:
+        mask |= 1 << fact_ids[fact]
+    return mask
+
+
+class CompiledPlanningTask:
+    """
+    A PlanningTask where each fact is given a dense integer id and states
+    are fixed-width bitsets stored in python ints : bit i is set
+    if and only if the fact with id i is true.
+    """
+
+    def __init__(self, task):
+        """
+        Parameters :
+        - task : the PlanningTask to compile
+        """
+        self.task = task
+        self.name = task.name
+        # sort the facts so that the ids do not depend on the set ordering
+        self.facts = sorted(task.facts)
+        self.fact_ids = {fact: idx for idx, fact in enumerate(self.facts)}
+        self.initial_state = self.encode_state(task.initial_state)
+        self.goals = self.encode_state(task.goals)
+        self.operators = [CompiledOperator(op, self.fact_ids)
+                          for op in task.operators]
+        self._successor_generator = None
+
+    @property
+    def successor_generator(self):
+        """The successor generator, built from the operators on first use"""
+        if self._successor_generator is None:
+            self._successor_generator = BitsetSuccessorGenerator(
+                self.operators)
+        return self._successor_generator
+
+    def encode_state(self, facts):
+        """Returns the bitset representing a set of facts"""
+        return facts_to_mask(facts, self.fact_ids)
+
+    def decode_state(self, state):
+        """Returns the set of facts represented by a bitset"""
+        return frozenset(fact for idx, fact in enumerate(self.facts) if state >> idx & 1)
+
+    def is_goal_reached(self, state):
+        return state & self.goals == self.goals
+
+    def get_next_states(self, state):
+        """
+        Returns a list of (op, new_state) pairs where "op" is an applicable
+        operator and "new_state" is the state obtained after applying op in new_state
+        """
+        return self.successor_generator.get_next_states(state)
+
+    def __str__(self):
+        return str(self.task)
+
+    def __repr__(self):
+        string = "<CompiledTask {0}, num_facts: {1}, num_operators: {2}>"
+        return string.format(self.name, len(self.facts), len(self.operators))
@@ -152,3 +152,58 @@ class GraphPlanRelaxed():
         self.expand_until_goal()  # create graph
         actions = self.back_from_goal()  # set of actions to go to the goal
         return actions, len(actions)
+
+
+class ReachabilityLayers:
+    """
+    First layers of the facts and operators in the planning graph of a task
+    (without mutexes) :
+    - true_layers, false_layers : the first step at which a fact can be true, resp. false
+    - operator_layers : the first step at which an operator can be applied
+    The facts and operators which are never reachable are not in the dicts.
+    Since the delete effects are kept to know when a fact can become false, the
+    negative preconditions are handled exactly as the positive ones.
+    """
+
+    def __init__(self, task):
+        self.true_layers = {fact: 0 for fact in task.initial_state}
+        self.false_layers = {fact: 0 for fact in task.facts
+                             if fact not in task.initial_state}
+        self.operator_layers = {}
+        self.goals = task.goals
+
+        remaining = list(task.operators)
+        layer = 0
+        while remaining:
+            applicable = []
+            not_applicable = []
+            for operator in remaining:
+                if self._is_applicable(operator, layer):
+                    applicable.append(operator)
+                else:
+                    not_applicable.append(operator)
+            if not applicable:
+                break
+            for operator in applicable:
+                self.operator_layers[operator] = layer
+                for fact in operator.add_effects:
+                    self.true_layers.setdefault(fact, layer + 1)
+                for fact in operator.del_effects - operator.add_effects:
+                    self.false_layers.setdefault(fact, layer + 1)
+            remaining = not_applicable
+            layer += 1
+
+    def _is_applicable(self, operator, layer):
+        return (all(self.true_layers.get(fact, layer + 1) <= layer
+                    for fact in operator.pos_preconditions)
+                and all(self.false_layers.get(fact, layer + 1) <= layer
+                        for fact in operator.neg_preconditions))
+
+    def get_lower_bound(self):
+        """
+        Returns the first layer at which all the goals can be true (the h_max value of
+        the initial state), which is a lower bound on the number of steps of a plan,
+        or inf if a goal is unreachable
+        """
+        return max((self.true_layers.get(goal, float("inf")) for goal in self.goals),
+                   default=0)
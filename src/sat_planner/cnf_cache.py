@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from src.sat_planner.minisat_utils import CnfFormula
+from src.sat_planner.plan_extractor import get_operator_key
+
+
+def get_task_hash(task):
+    """Returns a hash of the facts, initial state, goals and operators of a task"""
+    digest = hashlib.sha256()
+
+    def update(*parts):
+        digest.update(repr(parts).encode())
+
+    update('facts', sorted(task.facts))
+    update('initial_state', sorted(task.initial_state))
+    update('goals', sorted(task.goals))
+    for operator in sorted(task.operators, key=get_operator_key):
+        update(operator.name, sorted(operator.pos_preconditions), sorted(operator.neg_preconditions),
+               sorted(operator.add_effects), sorted(operator.del_effects))
+    return digest.hexdigest()
+
+
+class CnfCache:
+    """
+    On-disk cache of the formulas of a task, in a directory named after the hash of the
+    task and of the encoding options. For each horizon, it stores :
+    - <horizon>.npy : the 0-terminated literals of the formula, loaded with a memory map
+    - <horizon>.json : the number of variables and clauses of the formula, and the
+    result of the solver (SAT or UNSAT) once the horizon has been solved
+    The files are written to temporary files and then renamed, so that several runs
+    can share the cache.
+    """
+
+    VERSION = 1
+
+    def __init__(self, directory, task, **options):
+        """
+        Arguments
+        - directory : the root directory of the cache
+        - task : the grounded task
+        - options : the encoding options (encoding, mutexes, ...), which are part of the key
+        """
+        digest = hashlib.sha256()
+        digest.update(repr((self.VERSION, get_task_hash(task),
+                            sorted(options.items()))).encode())
+        self.directory = os.path.join(directory, digest.hexdigest())
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _get_path(self, horizon, extension):
+        return os.path.join(self.directory, '{}.{}'.format(horizon, extension))
+
+    def _load_info(self, horizon):
+        try:
+            with open(self._get_path(horizon, 'json'), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _store_info(self, horizon, info):
+        self._replace(self._get_path(horizon, 'json'),
+                      lambda file: file.write(json.dumps(info).encode()))
+
+    def _replace(self, path, write):
+        """Writes a file with the function write and renames it to path"""
+        descriptor, temp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                write(file)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def load_formula(self, horizon):
+        """Returns the cached CnfFormula of a horizon, or None if it is not cached"""
+        info = self._load_info(horizon)
+        if 'nb_vars' not in info:
+            return None
+        try:
+            literals = np.load(self._get_path(horizon, 'npy'), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        formula = CnfFormula(info['nb_vars'])
+        formula.nb_clauses = info['nb_clauses']
+        formula.chunks = [literals]
+        return formula
+
+    def store_formula(self, horizon, formula):
+        literals = np.concatenate(formula.chunks) if formula.chunks else \
+            np.zeros(0, dtype=np.int32)
+        self._replace(self._get_path(horizon, 'npy'),
+                      lambda file: np.save(file, literals.astype(np.int32, copy=False)))
+        info = self._load_info(horizon)
+        info.update(nb_vars=formula.nb_vars, nb_clauses=formula.nb_clauses)
+        self._store_info(horizon, info)
+
+    def get_result(self, horizon):
+        """Returns SAT or UNSAT if the horizon has been solved, None otherwise"""
+        return self._load_info(horizon).get('result')
+
+    def set_result(self, horizon, result):
+        info = self._load_info(horizon)
+        info['result'] = result
+        self._store_info(horizon, info)
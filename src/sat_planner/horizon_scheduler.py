@@ -0,0 +1,163 @@
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from src.sat_planner.minisat_utils import SAT, UNSAT, CnfHandler
+
+
+class HorizonRun:
+    """
+    A minisat process solving the formula of one horizon.
+    - runtime : CPU time slices given to the process so far
+    - rate : share of the CPU time given to the process relative to the others
+    """
+
+    def __init__(self, horizon, input_file, output_file, rate):
+        self.horizon = horizon
+        self.input_file = input_file
+        self.output_file = output_file
+        self.rate = rate
+        self.runtime = 0
+        self.running = True
+        try:
+            self.process = subprocess.Popen(['minisat', input_file, output_file],
+                                            stderr=subprocess.DEVNULL,
+                                            stdout=subprocess.DEVNULL)
+        except OSError:
+            print('minisat could not be found. ')
+            sys.exit(1)
+
+    def pause(self):
+        if self.running:
+            self.process.send_signal(signal.SIGSTOP)
+            self.running = False
+
+    def resume(self):
+        if not self.running:
+            self.process.send_signal(signal.SIGCONT)
+            self.running = True
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+
+class HorizonScheduler:
+    """
+    Probes several horizons at once, each one in its own minisat process,
+    following the algorithms A and B of Rintanen (Planning as satisfiability :
+    parallel plans and algorithms for plan search, 2006) :
+    - nb_processes horizons are solved at the same time. When a horizon is
+    proved unsatisfiable, the next horizon is started. As soon as a horizon
+    is satisfiable, the other processes are stopped and its model is returned.
+    - the horizon t + k gets a share gamma ** k of the CPU time of the horizon t.
+    With gamma = 1, all the horizons get the same CPU time (algorithm A), with
+    gamma < 1, the short horizons are favoured (algorithm B).
+
+    The CPU time is shared out by slices : during each slice, only the nb_cores
+    processes which received the least CPU time relatively to their rate run,
+    and the other ones are paused with SIGSTOP.
+    """
+
+    def __init__(self, nb_processes=4, gamma=0.8, nb_cores=None, time_slice=0.05):
+        """
+        Arguments
+        - nb_processes : number of horizons solved at the same time
+        - gamma : ratio between the CPU time of a horizon and of the previous one
+        - nb_cores : number of processes running during a slice, default to the number of cores
+        - time_slice : duration in seconds of a slice
+        """
+        self.nb_processes = nb_processes
+        self.gamma = gamma
+        self.nb_cores = nb_cores or os.cpu_count() or 1
+        self.time_slice = time_slice
+
+    def find_model(self, formulas, on_result=None, timeout=None):
+        """
+        Arguments
+        - formulas : iterator over the pairs (horizon, CnfFormula) by increasing horizon,
+        which is only consumed when a new horizon is started
+        - on_result : optional function called with (horizon, status) for each horizon
+        decided by minisat, where status is SAT or UNSAT
+        - timeout : maximal CPU time in seconds given to each horizon, after which
+        its process is killed and the horizon is left undecided
+
+        Returns the first pair (horizon, valuation) found satisfiable,
+        or (None, []) if all the formulas are unsatisfiable.
+        """
+        directory = tempfile.mkdtemp(prefix='horizons_')
+        runs = []
+        formulas = iter(formulas)
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(runs) < self.nb_processes:
+                    run = self._start_next(formulas, directory)
+                    if run is None:
+                        exhausted = True
+                    else:
+                        # the new run starts with the same relative runtime as the
+                        # other runs, so that it does not get all the CPU time
+                        if runs:
+                            run.runtime = run.rate * min(
+                                other.runtime / other.rate for other in runs)
+                        runs.append(run)
+                if not runs:
+                    return None, []
+
+                self._schedule(runs)
+                time.sleep(self.time_slice)
+                for run in list(runs):
+                    if run.running:
+                        run.runtime += self.time_slice
+                    if run.process.poll() is None:
+                        if timeout is not None and run.runtime >= timeout:
+                            print('minisat timed out after {} seconds on the horizon {}'.format(
+                                timeout, run.horizon))
+                            run.kill()
+                            runs.remove(run)
+                        continue
+                    runs.remove(run)
+                    status, valuation = self._decode(run)
+                    if on_result is not None and status in (SAT, UNSAT):
+                        on_result(run.horizon, status)
+                    if status == SAT:
+                        return run.horizon, valuation
+                    if status == UNSAT:
+                        print('No plan with {} actions'.format(run.horizon))
+                    else:
+                        print('minisat failed on the horizon {}'.format(run.horizon))
+        finally:
+            for run in runs:
+                run.kill()
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _start_next(self, formulas, directory):
+        """Writes the formula of the next horizon and starts a minisat process on it"""
+        try:
+            horizon, formula = next(formulas)
+        except StopIteration:
+            return None
+        print('looking for a plan with {} actions ...'.format(horizon))
+        input_file = os.path.join(directory, '{}.cnf'.format(horizon))
+        output_file = os.path.join(directory, '{}.txt'.format(horizon))
+        CnfHandler(input_file, output_file).write(formula)
+        return HorizonRun(horizon, input_file, output_file, self.gamma ** horizon)
+
+    def _schedule(self, runs):
+        """Lets the nb_cores runs with the smallest runtime relatively to their rate run"""
+        by_priority = sorted(runs, key=lambda run: (
+            run.runtime / run.rate, run.horizon))
+        for run in by_priority[self.nb_cores:]:
+            run.pause()
+        for run in by_priority[:self.nb_cores]:
+            run.resume()
+
+    def _decode(self, run):
+        """Returns the pair (status, valuation) of a finished run, see CnfHandler.decode_output"""
+        return CnfHandler(run.input_file, run.output_file).decode_output(run.process.returncode)
@@ -1,4 +1,6 @@
 from sat_planner import SATPlanner
+from src.sat_planner.horizon_scheduler import HorizonScheduler
+from src.stats import Statistics
 
 if __name__ == '__main__':
     import argparse
@@ -12,17 +14,67 @@ if __name__ == '__main__':
         "--min_horizon", help="start horizon for the planner", required=False, default=1)
     parser.add_argument(
         "--max_horizon", help="end horizon for the planner", required=False, default=20)
+    parser.add_argument(
+        "--encoding", help="encoding of the transitions, classical, explanatory (explanatory frame axioms), "
+        "or forall_step and exists_step for parallel plans",
+        choices=["classical", "explanatory", "forall_step", "exists_step"], default="classical")
+    parser.add_argument(
+        "--relaxed_grounding", help="whether to ground or not only the operators reachable in the "
+        "delete relaxation", default=0)
+    parser.add_argument(
+        "--grounding_workers", help="number of processes used to ground the actions, default to 1",
+        default=1)
+    parser.add_argument(
+        "--mutexes", help="whether to add or not the h2 mutexes of the task to the formulas", default=0)
+    parser.add_argument(
+        "--reachability", help="whether to use or not the layers of the planning graph to fix the unreachable "
+        "facts and operators and to start from the first horizon where the goals are reachable", default=0)
+    parser.add_argument(
+        "--incremental", help="whether to use or not a single incremental solver for all the horizons",
+        default=0)
+    parser.add_argument(
+        "--solver", help="python-sat solver used by the incremental mode, default to minisat22",
+        default="minisat22")
+    parser.add_argument(
+        "--processes", help="number of horizons solved at the same time by minisat processes, default to 1",
+        default=1)
+    parser.add_argument(
+        "--gamma", help="ratio between the CPU time of a horizon and of the previous one when several "
+        "horizons are solved at the same time, 1 for Rintanen's algorithm A, default to 0.8 (algorithm B)",
+        default=0.8)
+    parser.add_argument(
+        "--timeout", help="maximal time in seconds given to minisat for each horizon, "
+        "not supported with --incremental", default=None)
+    parser.add_argument(
+        "--cache_dir", help="directory of the cache of the formulas and of the results of the horizons",
+        default=None)
     parser.add_argument(
         "--output_file", help="path to the file to store the outputs", default="benchmark_results.txt")
+    parser.add_argument(
+        "--stats_file", help="path to a json file to store the statistics of the run", default=None)
     args = parser.parse_args()
+    if args.timeout and int(args.incremental):
+        parser.error('--timeout is not supported with --incremental')
 
     f = open(args.output_file, 'a')
     print('Using SAT planner ... ')
     print('Using SAT solver', file=f)
     t0 = time.time()
-    planner = SATPlanner(args.domain_file, args.problem_file)
+    stats = Statistics()
+    planner = SATPlanner(args.domain_file, args.problem_file,
+                         stats=stats, encoding=args.encoding, mutexes=bool(int(args.mutexes)),
+                         reachability=bool(int(args.reachability)), cache_dir=args.cache_dir,
+                         relaxed_grounding=bool(int(args.relaxed_grounding)),
+                         grounding_workers=int(args.grounding_workers))
+    scheduler = None
+    if int(args.processes) > 1:
+        scheduler = HorizonScheduler(
+            nb_processes=int(args.processes), gamma=float(args.gamma))
     plan = planner.find_plan(min_horizon=int(args.min_horizon),
-                             max_horizon=int(args.max_horizon))
+                             max_horizon=int(args.max_horizon),
+                             incremental=bool(int(args.incremental)),
+                             solver_name=args.solver, scheduler=scheduler,
+                             timeout=float(args.timeout) if args.timeout else None)
     if plan:
         print('A plan was found. Ellapsed time : {}'.format(time.time()-t0))
         print('A plan was found. Ellapsed time : {}'.format(
@@ -39,3 +91,6 @@ if __name__ == '__main__':
                 state = op.apply(state)
 
         assert planner.task.goals.issubset(state), "non valid solution"
+
+    if args.stats_file:
+        stats.dump(args.stats_file)
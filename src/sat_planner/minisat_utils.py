@@ -1,178 +1,257 @@
 import os
+import shutil
 import sys
 import subprocess
+import tempfile
+
+import numpy as np
+
+# status of a formula after a call to a solver. UNKNOWN means that the solver
+# did not decide the formula (timeout, crash, INDET output ...)
+SAT = 'SAT'
+UNSAT = 'UNSAT'
+UNKNOWN = 'UNKNOWN'
+
+# exit codes of minisat
+SAT_EXIT_CODE = 10
+UNSAT_EXIT_CODE = 20
+
+
+class CnfFormula:
+    """
+    A CNF formula over the integer variables 1..nb_vars.
+    The clauses are stored in chunks, which are int32 arrays of literals
+    where each clause is terminated by a 0 (as in the DIMACS format).
+    Chunks are never modified, so that formulas can share them.
+    """
+
+    def __init__(self, nb_vars=0):
+        self.nb_vars = nb_vars
+        self.nb_clauses = 0
+        self.chunks = []
+
+    def add_chunk(self, literals):
+        """Adds the clauses of a 0-terminated array of literals"""
+        self.chunks.append(literals)
+        self.nb_clauses += int(np.count_nonzero(literals == 0))
+
+    def add_clauses(self, clauses):
+        """Adds a list of clauses, each clause being a list of literals"""
+        literals = []
+        for clause in clauses:
+            literals.extend(clause)
+            literals.append(0)
+        self.add_chunk(np.array(literals, dtype=np.int32))
+
+    def copy(self):
+        formula = CnfFormula(self.nb_vars)
+        formula.nb_clauses = self.nb_clauses
+        formula.chunks = list(self.chunks)
+        return formula
 
 
 class CnfHandler:
+    # powers of 10 used to count the digits of the literals
+    POWERS_OF_TEN = 10 ** np.arange(1, 10, dtype=np.int64)
+
     def __init__(self, input_file='input.cnf', output_file='output.txt'):
         self.input_file = input_file
         self.output_file = output_file
 
     def write(self, formula):
-        """ Writes a formula to a cnf input file that will be fed to minisat"""
-        self.count = 1
-        self.vars_to_indices = {}
-
-        aux_iff_vars = set()
-        self.cnf_file = open(self.input_file, 'w')
-
-        while formula:
-
-            disjunction = formula.pop(0)
-            if not isinstance(disjunction, list):
-                self._write_clause([disjunction])
-                continue
-            new_clause = []
-            for conjunction in disjunction:
-
-                if not isinstance(conjunction, list):
-                    new_clause.append(conjunction)
-                    continue
-                # auxiliary vars for iffs
-                for literal in conjunction:
-                    if '<->' in literal and literal not in aux_iff_vars:
-                        self._write_clauses(self._get_aux_clauses_for_iff(
-                            literal))
-                        aux_iff_vars.add(literal)
-                # Turn list into a literal and add auxiliary clauses
-                while len(conjunction) > 1:
-                    left = conjunction.pop(0)
-                    right = conjunction.pop(0)
-                    aux_var, clauses = self._get_aux_clauses_for_and(left,
-                                                                     right)
-                    conjunction.insert(0, aux_var)
-                    self._write_clauses(clauses)
-                assert len(conjunction) == 1, conjunction
-                new_clause.append(conjunction[0])
-            self._write_clause(new_clause)
-
-        self.cnf_file.close()
-        for var in list(self.vars_to_indices):
-            if '<->' in var:
-                del self.vars_to_indices[var]
-        return self.vars_to_indices
-
-    def _literal_to_index(self, literal):
-        if type(literal) is int:
-            return literal
-        negated = literal.startswith("not-")
-        if negated:
-            # remove the 'not-'
-            literal = literal[4:]
-        if literal in self.vars_to_indices:
-            idx = self.vars_to_indices[literal]
-        else:
-            self.count += 1
-            idx = self.count
-            self.vars_to_indices[literal] = idx
-        if negated:
-            idx = -idx
-        return idx
-
-    def _write_clause(self, clause):
-        print(' '.join([str(self._literal_to_index(literal))
-              for literal in clause]) + ' 0', file=self.cnf_file)
-
-    def _write_clauses(self, clauses):
-        for clause in clauses:
-            self._write_clause(clause)
-
-    def _get_aux_clauses_for_iff(self, iff):
-        left, right = iff.split('<->')
-        return [[iff, left, right],
-                [iff, 'not-'+left, 'not-'+right],
-                ['not-'+iff, left, 'not-'+right],
-                ['not-'+iff, 'not-'+left, right]]
-
-    def _get_aux_clauses_for_and(self, left, right):
-        self.count += 1
-        aux_var = self.count
-        if type(left) is str:
-            if left.startswith('not-'):
-                not_left = left[4:]
-            else:
-                not_left = 'not-'+left
-        else:
-            not_left = -left
-
-        if type(right) is str:
-            if right.startswith('not-'):
-                not_right = right[4:]
-            else:
-                not_right = 'not-'+right
-        else:
-            not_right = -right
-        return aux_var, [[-aux_var, left], [-aux_var, right], [not_left, not_right, aux_var]]
+        """ Writes a CnfFormula to a cnf input file that will be fed to minisat"""
+        with open(self.input_file, 'wb', buffering=1 << 20) as cnf_file:
+            cnf_file.write('p cnf {} {}\n'.format(
+                formula.nb_vars, formula.nb_clauses).encode())
+            for chunk in formula.chunks:
+                if len(chunk):
+                    cnf_file.write(self.to_dimacs(chunk))
 
-    def decode_output(self, names_to_indices):
+    @classmethod
+    def to_dimacs(cls, literals):
         """
-        Transform the outputs of minisat back into
-        the text-variable-names required by our planer.
+        Returns the DIMACS bytes of a 0-terminated array of literals, where
+        each literal is followed by a space, or by a new line if it is a 0.
+        The digits of all the literals are computed at once with numpy.
         """
+        literals = np.asarray(literals, dtype=np.int64)
+        values = np.abs(literals)
+        nb_digits = 1 + np.searchsorted(cls.POWERS_OF_TEN, values, side='right')
+        negative = literals < 0
+        ends = np.cumsum(nb_digits + negative + 1)
+        buffer = np.empty(ends[-1], dtype=np.uint8)
+        buffer[ends - 1] = np.where(literals == 0, ord('\n'), ord(' '))
+        buffer[(ends - nb_digits - 2)[negative]] = ord('-')
+        positions = ends - 2
+        for _ in range(int(nb_digits.max())):
+            has_digit = nb_digits > 0
+            buffer[positions[has_digit]] = ord('0') + values[has_digit] % 10
+            values //= 10
+            nb_digits -= 1
+            positions -= 1
+        return buffer.tobytes()
 
-        indices_to_names = dict()
-        for name, idx in names_to_indices.items():
-            indices_to_names[idx] = name
-
+    def decode_output(self, returncode=None):
+        """
+        Returns a pair (status, valuation) where status is SAT, UNSAT or UNKNOWN
+        and valuation is the list of literals of the model found by minisat,
+        or an empty list if the formula is not satisfiable.
+        The status is read from the header of the output, or from the exit code
+        returncode of minisat if there is no output. An INDET header, a missing
+        output or any other exit code give the status UNKNOWN.
+        """
+        status = UNKNOWN
         decoded = []
 
-        with open(self.output_file, 'r') as file:
-            lines = file.readlines()
-        if lines[0].startswith('SAT'):
-            vars = lines[1].split()
-            # the last element of a line is always a 0
-            for var in vars[:-1]:
-                negation = ''
-                if var.startswith('-'):
-                    negation = 'not-'
-                    var = var[1:]
-                var = indices_to_names.get(int(var))
-
-                if var:
-                    decoded.append(negation + var)
         try:
+            with open(self.output_file, 'rb') as file:
+                header = file.readline().strip()
+                if header == b'SAT':
+                    # the last element of the model is always a 0
+                    decoded = np.array(file.readline().split()[:-1],
+                                       dtype=np.int64).tolist()
+                    status = SAT if decoded else UNKNOWN
+                elif header == b'UNSAT':
+                    status = UNSAT
             os.remove(self.output_file)
-        except OSError:
-            pass
-        return decoded
+        except (OSError, ValueError):
+            decoded = []
+        if status == UNKNOWN and not decoded and returncode == UNSAT_EXIT_CODE:
+            status = UNSAT
+        return status, decoded
 
 
 class MinisatSolver:
-    def __init__(self, input_file='input.cnf', output_file='output.txt'):
+    def __init__(self, input_file=None, output_file=None, timeout=None):
+        """
+        Arguments
+        - input_file, output_file : the files exchanged with minisat. By default,
+        they are created in a private temporary directory for each call to solve,
+        so that several solvers can run at the same time.
+        - timeout : maximal time in seconds given to minisat for a formula
+        """
         self.input_file = input_file
         self.output_file = output_file
+        self.timeout = timeout
+        # whether minisat timed out on the last formula
+        self.timed_out = False
 
-    def _solve_minisat(self):
+    def _solve_minisat(self, input_file, output_file):
         """
-        Calls minisat with the specified formula, the number of variables
-        and the number of clauses.
-        Returns the output filename of the minisat computation.
+        Calls minisat on the input file, which writes its result in the output file,
+        and returns its exit code, or None if it was killed.
+        The process is killed if it exceeds the timeout.
         """
         try:
-            process = subprocess.Popen(['minisat', self.input_file, self.output_file],
-                                       stderr=subprocess.PIPE,
-                                       stdout=subprocess.PIPE)
-            process.wait()
+            process = subprocess.Popen(['minisat', input_file, output_file],
+                                       stderr=subprocess.DEVNULL,
+                                       stdout=subprocess.DEVNULL)
         except OSError:
             print('minisat could not be found. '
                   )
 
             sys.exit(1)
         try:
-            os.remove(self.input_file)
-        except OSError:
-            pass
+            return process.wait(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            print('minisat timed out after {} seconds'.format(self.timeout))
+            self.timed_out = True
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+                # the output of a killed minisat is incomplete
+                try:
+                    os.remove(output_file)
+                except OSError:
+                    pass
+        return None
 
     def solve(self, formula):
         """
-        Transforms the formula into the format required by minisat, feed the transformed
-        formula to minisat and decodes the output of minisat.
-        If the formula is satisfiable, a list of variables is returned.
-        If the formula is unsatisfiable, an empty list is returned.
+        Writes the CnfFormula in the format required by minisat, feed it
+        to minisat and decodes the output of minisat.
+        Returns a pair (status, valuation) : the status is SAT, UNSAT, or UNKNOWN if
+        minisat timed out or failed, and valuation is the list of literals of the model
+        if the formula is satisfiable, an empty list otherwise.
+        """
+        self.timed_out = False
+        directory = None
+        input_file, output_file = self.input_file, self.output_file
+        if input_file is None or output_file is None:
+            directory = tempfile.mkdtemp(prefix='minisat_')
+            input_file = input_file or os.path.join(directory, 'input.cnf')
+            output_file = output_file or os.path.join(
+                directory, 'output.txt')
+        try:
+            cnf_handler = CnfHandler(input_file, output_file)
+            cnf_handler.write(formula)
+            returncode = self._solve_minisat(input_file, output_file)
+            return cnf_handler.decode_output(returncode)
+        finally:
+            try:
+                os.remove(input_file)
+            except OSError:
+                pass
+            if directory is not None:
+                shutil.rmtree(directory, ignore_errors=True)
+
+
+class IncrementalSolver:
+    """
+    Keeps a single solver instance alive (through python-sat) between calls,
+    so that the clauses are added only once and the learnt clauses are kept.
+    The goals are not added as clauses but passed as assumptions to solve.
+    """
+
+    def __init__(self, name='minisat22'):
+        """
+        Arguments
+        - name : name of the python-sat solver, e.g. minisat22, glucose4 or cadical153
         """
+        try:
+            from pysat.solvers import Solver
+        except ImportError:
+            print('python-sat is required by the incremental SAT solver. '
+                  'Install it with pip install python-sat')
+            sys.exit(1)
+        self.solver = Solver(name=name)
+
+    def add_chunk(self, literals):
+        """Adds the clauses of a 0-terminated array of literals"""
+        clause = []
+        for literal in literals.tolist():
+            if literal:
+                clause.append(literal)
+            else:
+                self.solver.add_clause(clause)
+                clause = []
+
+    def add_formula(self, formula):
+        """Adds the clauses of a CnfFormula"""
+        for chunk in formula.chunks:
+            self.add_chunk(chunk)
+
+    def solve(self, assumptions=()):
+        """
+        Solves the clauses added so far under the assumption literals.
+        If they are satisfiable, the list of literals of the model is returned.
+        Otherwise, an empty list is returned, and the negation of the
+        assumptions responsible for the conflict is added as a clause, since
+        it stays true when clauses are added.
+        """
+        if self.solver.solve(assumptions=list(assumptions)):
+            return self.solver.get_model()
+        core = self.solver.get_core()
+        if core:
+            self.solver.add_clause([-literal for literal in core])
+        return []
+
+    def close(self):
+        self.solver.delete()
+
+    def __enter__(self):
+        return self
 
-        cnf_handler = CnfHandler(self.input_file, self.output_file)
-        vars_to_indices = cnf_handler.write(formula)
-        self._solve_minisat()
-        valuation = cnf_handler.decode_output(vars_to_indices)
-        return valuation
+    def __exit__(self, *args):
+        self.close()
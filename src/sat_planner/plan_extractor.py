@@ -1,30 +1,121 @@
 from src.planning_task import PlanningTask
+from src.sat_planner.minisat_utils import CnfFormula
+import numpy as np
 import os
 import sys
-import copy
-from collections import defaultdict
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.dirname(SCRIPT_DIR))
 
 
+def get_operator_key(operator):
+    """Returns a key ordering the operators independently of the run"""
+    return (operator.name, sorted(operator.pos_preconditions), sorted(operator.neg_preconditions),
+            sorted(operator.add_effects), sorted(operator.del_effects))
+
+
 class PlanExtractor:
+    """
+    Encodes a task with a given horizon into a CnfFormula and extracts
+    plans from the models of the formula.
+    Each fact at each step 0..horizon and each operator at each step 0..horizon-1
+    is given an integer variable. Variables are laid out step by step :
+    the variables of step t are t * step_size + 1 .. (t + 1) * step_size, with
+    the facts first, then the operators and then the auxiliary variables of the encoding.
+
+    Two encodings of the transitions are available :
+    - classical : each applied operator fixes the value of every fact at the next step,
+    which takes O(|operators| x |facts|) clauses per step
+    - explanatory : each applied operator only implies its preconditions and effects,
+    and explanatory frame axioms state that a fact which changes is changed by an
+    applied operator. Exactly one operator is applied at each step, the at most one
+    constraint being encoded with a ladder of auxiliary variables. This takes
+    O(|operators| + |facts| + size of the operators) clauses per step.
+    - forall_step and exists_step : parallel plans, where several operators can be
+    applied at each step, with the same implications and frame axioms as explanatory.
+    With forall_step, the operators applied at a step can be executed in any order,
+    i.e. none of them disables another one. With exists_step, they can be executed
+    by increasing operator index, i.e. none of them disables an operator with
+    a greater index. These interference constraints are encoded with chains of
+    auxiliary variables (Rintanen, Heljanko and Niemela, Planning as satisfiability :
+    parallel plans and algorithms for plan search, 2006), which are linear in
+    the size of the task.
+    """
+
+    ENCODINGS = ('classical', 'explanatory', 'forall_step', 'exists_step')
+    PARALLEL_ENCODINGS = ('forall_step', 'exists_step')
 
-    def __init__(self, task: PlanningTask):
+    def __init__(self, task: PlanningTask, encoding='classical', mutexes=None, layers=None):
+        """
+        Arguments
+        - task : the planning task
+        - encoding : the encoding of the transitions, one of ENCODINGS
+        - mutexes : pairs of facts which are never true together, added as binary
+        clauses at each step
+        - layers : ReachabilityLayers of the task, used to fix the facts and operators
+        which are not reachable at a step
+        """
+        if encoding not in self.ENCODINGS:
+            raise ValueError("Unknown encoding : {}".format(encoding))
         self.task = task
+        self.encoding = encoding
+        self.mutexes = mutexes or set()
+        self.facts = sorted(task.facts)
+        self.fact_ids = {fact: idx for idx, fact in enumerate(self.facts)}
+        # the operators are sorted so that the variables do not depend on the run
+        self.operators = sorted(task.operators, key=get_operator_key)
+        self.nb_aux_vars = 0
+        if encoding == 'explanatory':
+            self.nb_aux_vars = max(len(self.operators) - 1, 0)
+        elif encoding in self.PARALLEL_ENCODINGS:
+            self.interference_chains = self._get_interference_chains()
+            # an auxiliary variable is created for each element of a chain but the last one
+            self.nb_aux_vars = sum(len(chain) - 1
+                                   for chain in self.interference_chains)
+        self.step_size = len(self.facts) + \
+            len(self.operators) + self.nb_aux_vars
+        self.layers = layers
+        if layers is not None:
+            inf = float("inf")
+            self.true_layers = np.array([layers.true_layers.get(fact, inf)
+                                         for fact in self.facts])
+            self.false_layers = np.array([layers.false_layers.get(fact, inf)
+                                          for fact in self.facts])
+            self.operator_layers = np.array([layers.operator_layers.get(operator, inf)
+                                             for operator in self.operators])
+        self._step_template = None
         self.last_formula_without_goal = self.encode_initial_state_formula()
         self.last_horizon = 0
 
-    def encode_initial_state_formula(self):
-        init_facts_true = list(sorted(self.task.initial_state))
-        init_facts_false = list(
-            sorted(self.task.facts - self.task.initial_state))
+    @property
+    def step_template(self):
+        """
+        The clauses of step 0, which are shifted to get the clauses of the other steps.
+        They are built on first use.
+        """
+        if self._step_template is None:
+            self._step_template = self._get_step_template()
+        return self._step_template
+
+    def get_fact_var(self, fact_id, step):
+        """Returns the variable of a fact at a given step"""
+        return step * self.step_size + fact_id + 1
 
-        positive_fluents = [self._get_fluent_string(
-            fact, 0) for fact in init_facts_true]
-        negative_fluents = [self._get_fluent_string(
-            fact, 0, negated=True) for fact in init_facts_false]
+    def get_operator_var(self, op_id, step):
+        """Returns the variable of an operator at a given step"""
+        return step * self.step_size + len(self.facts) + op_id + 1
 
-        formula = positive_fluents + negative_fluents
+    def get_aux_var(self, aux_id, step):
+        """Returns an auxiliary variable of the encoding at a given step"""
+        return step * self.step_size + len(self.facts) + len(self.operators) + aux_id + 1
+
+    def _get_nb_vars(self, horizon):
+        return self.get_fact_var(len(self.facts) - 1, horizon)
+
+    def encode_initial_state_formula(self):
+        formula = CnfFormula(self._get_nb_vars(0))
+        formula.add_clauses([[self.get_fact_var(idx, 0)] if fact in self.task.initial_state
+                             else [-self.get_fact_var(idx, 0)]
+                             for idx, fact in enumerate(self.facts)])
         return formula
 
     def encode_plan_formula(self, horizon):
@@ -35,17 +126,12 @@ class PlanExtractor:
         formula = self.encode_initial_state_formula()
 
         for step in range(horizon):
-            disjunction = []
-            for op in self.task.operators:
-                disjunction.append(self._get_formula_for_operator(
-                    op, step))
-            formula.append(disjunction)
+            formula.add_chunk(self._encode_step(step))
+        formula.nb_vars = self._get_nb_vars(horizon)
 
-        self.last_formula_without_goal = copy.deepcopy(formula)
+        self.last_formula_without_goal = formula.copy()
 
-        goal = [self._get_fluent_string(fact, horizon)
-                for fact in list(sorted(self.task.goals))]
-        formula.extend(goal)
+        formula.add_clauses(self._get_goal_clauses(horizon))
 
         self.last_horizon = horizon
 
@@ -53,89 +139,295 @@ class PlanExtractor:
 
     def encode_formula_next_horizon(self):
 
-        disjunction = []
-        for op in self.task.operators:
-            disjunction.append(self._get_formula_for_operator(
-                op, self.last_horizon))
-        self.last_formula_without_goal.append(disjunction)
+        self.encode_next_step()
 
-        new_formula = copy.deepcopy(self.last_formula_without_goal)
+        new_formula = self.last_formula_without_goal.copy()
+        new_formula.add_clauses(self._get_goal_clauses(self.last_horizon))
 
-        goal = [self._get_fluent_string(fact, self.last_horizon+1)
-                for fact in list(sorted(self.task.goals))]
-        new_formula.extend(goal)
+        return new_formula
+
+    def encode_next_step(self):
+        """
+        Adds the clauses of the next step to the formula without goal,
+        increments the horizon and returns the new clauses
+        """
+        chunk = self._encode_step(self.last_horizon)
+        self.last_formula_without_goal.add_chunk(chunk)
         self.last_horizon += 1
+        self.last_formula_without_goal.nb_vars = self._get_nb_vars(
+            self.last_horizon)
+        return chunk
 
-        return new_formula
+    def get_goal_assumptions(self, horizon):
+        """Returns the literals stating that the goals are reached at the horizon"""
+        return [clause[0] for clause in self._get_goal_clauses(horizon)]
+
+    def _get_goal_clauses(self, horizon):
+        return [[self.get_fact_var(self.fact_ids[fact], horizon)]
+                for fact in sorted(self.task.goals)]
 
-    def _get_fluent_string(self, fact, step, negated=False):
+    def _encode_step(self, step):
         """
-        Returns a string representing a fluent. The representation contains the fluent name 
-        preceded by a 'not' if it is negated and the step number
+        Returns the clauses of a step, obtained by shifting the variables
+        of the clauses of step 0
         """
-        name = str(fact)
-        if negated:
-            name = "not-" + name
-        return "{}-{}".format(name, step)
+        template = self.step_template
+        chunk = template + np.sign(template) * np.int32(step * self.step_size)
+        if self.layers is not None:
+            chunk = np.concatenate(
+                (chunk, self._get_reachability_clauses(step)))
+        return chunk
 
-    def _get_formula_for_fact(self, operator, fact, step):
+    def _get_reachability_clauses(self, step):
         """
-        Returns a formula to encode the fluent representing 'fact' at step 'step'
+        Returns the unit clauses of a step fixing the operators which are not
+        reachable at the step to false, and the facts which cannot be true (resp. false)
+        at the next step to false (resp. true)
+        """
+        op_ids = np.nonzero(self.operator_layers > step)[0]
+        false_fact_ids = np.nonzero(self.true_layers > step + 1)[0]
+        true_fact_ids = np.nonzero(self.false_layers > step + 1)[0]
+        literals = np.concatenate((
+            -(op_ids + step * self.step_size + len(self.facts) + 1),
+            -(false_fact_ids + (step + 1) * self.step_size + 1),
+            true_fact_ids + (step + 1) * self.step_size + 1)).astype(np.int32)
+        clauses = np.zeros(2 * len(literals), dtype=np.int32)
+        clauses[::2] = literals
+        return clauses
+
+    def _get_step_template(self):
+        """
+        Returns the clauses encoding the transition between step 0 and step 1 :
+        at least one operator is applied, and each applied operator implies
+        its preconditions and its effects
+        """
+        clauses = [[self.get_operator_var(op_id, 0)
+                    for op_id in range(len(self.operators))]]
+        if self.encoding == 'explanatory':
+            clauses += self._get_at_most_one_operator_formula()
+        elif self.encoding in self.PARALLEL_ENCODINGS:
+            clauses += self._get_interference_formula()
+        if self.encoding != 'classical':
+            for op_id, operator in enumerate(self.operators):
+                clauses += self._get_formula_for_operator_effects(
+                    operator, op_id)
+            clauses += self._get_explanatory_frame_axioms()
+        else:
+            for op_id, operator in enumerate(self.operators):
+                clauses += self._get_formula_for_operator(operator, op_id)
+        # the mutexes hold in the initial state, so they are only stated at step 1
+        for mutex in sorted(sorted(mutex) for mutex in self.mutexes):
+            clauses.append([-self.get_fact_var(self.fact_ids[fact], 1)
+                            for fact in mutex])
+        literals = []
+        for clause in clauses:
+            literals.extend(clause)
+            literals.append(0)
+        return np.array(literals, dtype=np.int32)
+
+    def _get_formula_for_fact(self, operator, op_var, fact_id, fact):
         """
+        Returns the clauses encoding the value of a fact at step 1
+        when the operator is applied at step 0
+        """
+        fact_var = self.get_fact_var(fact_id, 0)
+        next_fact_var = self.get_fact_var(fact_id, 1)
         # if the operator makes fact true at step +1 (the fact is in the add effects of the operator)
         if fact in operator.add_effects:
-            return [self._get_fluent_string(fact, step+1)]
+            return [[-op_var, next_fact_var]]
         # if the fact does not occur in the operator effects : the fluents reprsenting the facts at step and step+1 are equivalent
         if not fact in operator.del_effects:
-            return ['<->'.join([self._get_fluent_string(fact, step+1), self._get_fluent_string(fact, step)])]
+            return [[-op_var, -next_fact_var, fact_var], [-op_var, next_fact_var, -fact_var]]
         # if the operator makes fact false at step+1 (the fact is in the del effects of the operator)
         else:
-            return [self._get_fluent_string(fact, step+1, negated=True)]
+            return [[-op_var, -next_fact_var]]
 
-    def _get_formula_for_operator(self, operator, step):
+    def _get_formula_for_preconditions(self, operator, op_var):
         """
-        Retruns a formula representing an operator at a given step
+        Returns the clauses stating that the preconditions of an operator
+        applied at step 0 hold
         """
-        pos_preconditions = list(sorted(operator.pos_preconditions))
-        neg_preconditions = list(sorted(operator.neg_preconditions))
-        formula = [self._get_fluent_string(fact, step)
-                   for fact in pos_preconditions] + [self._get_fluent_string(fact, step, negated=True)
-                                                     for fact in neg_preconditions]
-        for fact in self.task.facts:
-            formula += self._get_formula_for_fact(operator, fact, step)
-        return formula
+        clauses = [[-op_var, self.get_fact_var(self.fact_ids[fact], 0)]
+                   for fact in sorted(operator.pos_preconditions)]
+        clauses += [[-op_var, -self.get_fact_var(self.fact_ids[fact], 0)]
+                    for fact in sorted(operator.neg_preconditions)]
+        return clauses
 
-    def extract_plan(self, operators, valuation):
-        '''
-        Transforms a valuation i.e. a list of facts into a list of operators
-        '''
-        positive_facts = defaultdict(set)
-        negative_facts = defaultdict(set)
-        plan_length = -1
+    def _get_formula_for_operator_effects(self, operator, op_id):
+        """
+        Returns the clauses stating that an operator applied at step 0
+        implies its preconditions at step 0 and its effects at step 1
+        """
+        op_var = self.get_operator_var(op_id, 0)
+        clauses = self._get_formula_for_preconditions(operator, op_var)
+        clauses += [[-op_var, self.get_fact_var(self.fact_ids[fact], 1)]
+                    for fact in sorted(operator.add_effects)]
+        # the add effects win over the del effects, as in Operator.apply
+        clauses += [[-op_var, -self.get_fact_var(self.fact_ids[fact], 1)]
+                    for fact in sorted(operator.del_effects - operator.add_effects)]
+        return clauses
+
+    def _get_explanatory_frame_axioms(self):
+        """
+        Returns the clauses stating that a fact which becomes true (resp. false)
+        between step 0 and step 1 is added (resp. deleted) by an applied operator
+        """
+        adders = [[] for _ in self.facts]
+        deleters = [[] for _ in self.facts]
+        for op_id, operator in enumerate(self.operators):
+            op_var = self.get_operator_var(op_id, 0)
+            for fact in operator.add_effects:
+                adders[self.fact_ids[fact]].append(op_var)
+            for fact in operator.del_effects - operator.add_effects:
+                deleters[self.fact_ids[fact]].append(op_var)
+        clauses = []
+        for fact_id in range(len(self.facts)):
+            fact_var = self.get_fact_var(fact_id, 0)
+            next_fact_var = self.get_fact_var(fact_id, 1)
+            clauses.append([fact_var, -next_fact_var] + adders[fact_id])
+            clauses.append([-fact_var, next_fact_var] + deleters[fact_id])
+        return clauses
+
+    def _get_at_most_one_operator_formula(self):
+        """
+        Returns the clauses stating that at most one operator is applied at step 0,
+        with the ladder encoding : the auxiliary variable i is true if one of the
+        operators 0..i is applied
+        """
+        nb_operators = len(self.operators)
+        clauses = []
+        for op_id in range(nb_operators):
+            op_var = self.get_operator_var(op_id, 0)
+            if op_id < nb_operators - 1:
+                clauses.append([-op_var, self.get_aux_var(op_id, 0)])
+            if op_id > 0:
+                previous_aux_var = self.get_aux_var(op_id - 1, 0)
+                clauses.append([-op_var, -previous_aux_var])
+                if op_id < nb_operators - 1:
+                    clauses.append(
+                        [-previous_aux_var, self.get_aux_var(op_id, 0)])
+        return clauses
 
-        for fact in valuation:
-            if ('<->' in fact) or ('AND' in fact):
+    def _get_interference_chains(self):
+        """
+        Returns the chains of operators used to forbid interfering operators at the same step.
+        The operators deleting a fact disable the operators requiring it, and the operators
+        adding a fact disable the operators requiring it to be false.
+        For each fact, the disabling and disabled operators are ordered by index
+        (and also by decreasing index with forall_step) in a chain of triples
+        (op_id, disables, is_disabled). Each chain starts with a disabling operator
+        and ends with a disabled operator.
+        """
+        nb_facts = len(self.facts)
+        # the facts required to be false have the ids nb_facts .. 2 * nb_facts - 1
+        disabling = [set() for _ in range(2 * nb_facts)]
+        disabled = [set() for _ in range(2 * nb_facts)]
+        for op_id, operator in enumerate(self.operators):
+            for fact in operator.del_effects - operator.add_effects:
+                disabling[self.fact_ids[fact]].add(op_id)
+            for fact in operator.add_effects:
+                disabling[nb_facts + self.fact_ids[fact]].add(op_id)
+            for fact in operator.pos_preconditions:
+                disabled[self.fact_ids[fact]].add(op_id)
+            for fact in operator.neg_preconditions:
+                disabled[nb_facts + self.fact_ids[fact]].add(op_id)
+
+        chains = []
+        for disabling_ops, disabled_ops in zip(disabling, disabled):
+            if not disabling_ops or not disabled_ops:
                 continue
+            op_ids = sorted(disabling_ops | disabled_ops)
+            orders = [op_ids]
+            if self.encoding == 'forall_step':
+                orders.append(op_ids[::-1])
+            for order in orders:
+                chain = []
+                for op_id in order:
+                    # the disabled operators before the first disabling one are not constrained
+                    if chain or op_id in disabling_ops:
+                        chain.append((op_id, op_id in disabling_ops,
+                                      op_id in disabled_ops))
+                while chain and not chain[-1][2]:
+                    chain.pop()
+                if len(chain) > 1:
+                    chains.append(chain)
+        return chains
 
-            parts = fact.split('-')
-            depth = int(parts[-1])
-            plan_length = max(plan_length, depth)
-
-            if fact.startswith("not-"):
-                variable_name = "-".join(parts[:-1])
-                negative_facts[depth].add(variable_name)
-            else:
-                variable_name = "-".join(parts[:-1])
-                positive_facts[depth].add(variable_name)
-
-        plan = []
-        for step in range(plan_length):
-            current_state = positive_facts[step]
-            next_state = positive_facts[step+1]
-            chosen_operator = None
-            for op in operators:
-                if op.applicable(current_state) and op.apply(current_state) == next_state:
-                    chosen_operator = op
+    def _get_interference_formula(self):
+        """
+        Returns the clauses stating that a disabled operator of a chain is not applied
+        at step 0 if a disabling operator before it in the chain is applied.
+        The auxiliary variable of the i-th element of a chain is true if a disabling
+        operator among the first i + 1 elements is applied.
+        """
+        clauses = []
+        aux_id = 0
+        for chain in self.interference_chains:
+            previous_aux_var = None
+            for idx, (op_id, disables, is_disabled) in enumerate(chain):
+                op_var = self.get_operator_var(op_id, 0)
+                if is_disabled and previous_aux_var is not None:
+                    clauses.append([-previous_aux_var, -op_var])
+                if idx == len(chain) - 1:
                     break
-            plan.append(chosen_operator)
+                aux_var = self.get_aux_var(aux_id, 0)
+                aux_id += 1
+                if disables:
+                    clauses.append([-op_var, aux_var])
+                if previous_aux_var is not None:
+                    clauses.append([-previous_aux_var, aux_var])
+                previous_aux_var = aux_var
+        return clauses
+
+    def _get_formula_for_operator(self, operator, op_id):
+        """
+        Retruns the clauses representing an operator at step 0
+        """
+        op_var = self.get_operator_var(op_id, 0)
+        clauses = self._get_formula_for_preconditions(operator, op_var)
+        for fact_id, fact in enumerate(self.facts):
+            clauses += self._get_formula_for_fact(operator,
+                                                  op_var, fact_id, fact)
+        return clauses
+
+    def extract_plan(self, valuation, horizon=None):
+        '''
+        Transforms a valuation i.e. a list of literals into a list of operators, read from
+        the true operator variables. The horizon of the valuation defaults to the last
+        encoded horizon.
+        With the parallel encodings, the operators applied at a step are executed by
+        increasing index. Otherwise, a single operator is taken at each step : with the
+        classical encoding, all the operators true at a step lead to the same next state.
+        The plan is checked against the task.
+        '''
+        if not valuation:
+            return []
+        if horizon is None:
+            horizon = self.last_horizon
+        literals = np.asarray(valuation, dtype=np.int64)
+        var_ids = literals[literals > 0] - 1
+        steps = var_ids // self.step_size
+        op_ids = var_ids % self.step_size - len(self.facts)
+        is_operator = (op_ids >= 0) & (
+            op_ids < len(self.operators)) & (steps < horizon)
+        steps = steps[is_operator]
+        op_ids = op_ids[is_operator]
+        order = np.lexsort((op_ids, steps))
+        steps = steps[order]
+        op_ids = op_ids[order]
+        if self.encoding not in self.PARALLEL_ENCODINGS:
+            # first operator of each step
+            _, first = np.unique(steps, return_index=True)
+            op_ids = op_ids[first]
+        plan = [self.operators[op_id] for op_id in op_ids.tolist()]
+        assert self.is_valid_plan(plan), "the extracted plan is not valid"
         return plan
+
+    def is_valid_plan(self, plan):
+        """Returns True if the plan can be applied from the initial state and reaches the goals"""
+        state = self.task.initial_state
+        for operator in plan:
+            if not operator.applicable(state):
+                return False
+            state = operator.apply(state)
+        return self.task.goals.issubset(state)
@@ -1,7 +1,11 @@
-from src.sat_planner.minisat_utils import MinisatSolver
+from src.sat_planner.GraphPlanRelaxed import ReachabilityLayers
+from src.sat_planner.cnf_cache import CnfCache
+from src.sat_planner.minisat_utils import SAT, UNSAT, IncrementalSolver, MinisatSolver
 from src.sat_planner.plan_extractor import PlanExtractor
 from src.grounder import Grounder
+from src.mutexes import get_h2_mutexes
 from src.pddlparser import PDDLParser
+from src.stats import timed
 import sys
 import os
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -10,41 +14,186 @@ sys.path.append(os.path.dirname(SCRIPT_DIR))
 
 class SATPlanner:
 
-    def __init__(self, domain_file, problem_file, custom_assigner=None):
-        self.domain = PDDLParser.parse(domain_file)
-        self.problem = PDDLParser.parse(problem_file)
+    def __init__(self, domain_file, problem_file, custom_assigner=None, stats=None,
+                 encoding='classical', mutexes=False, reachability=False, cache_dir=None,
+                 relaxed_grounding=False, grounding_workers=1):
+        """
+        Parses and grounds the task. If stats is given, the statistics of
+        the parsing, the grounding and the calls to find_plan are added to it.
+        encoding is the encoding of the transitions used by the PlanExtractor :
+        classical, explanatory, or forall_step and exists_step for parallel plans,
+        where a horizon is a number of steps and not of actions.
+        If mutexes is True, the h2 mutexes of the task are added to the formulas.
+        If reachability is True, the facts and operators which are not reachable
+        at a step of the planning graph are fixed in the formulas, and the horizons
+        smaller than the first layer containing the goals are skipped.
+        If cache_dir is given, the formulas and the results of the horizons are stored
+        in a CnfCache in this directory, and the horizons known to be unsatisfiable
+        are skipped. Only the horizons decided by the solver are stored, not the ones
+        where it timed out or failed.
+        If relaxed_grounding is True, only the operators reachable in the delete
+        relaxation are grounded.
+        grounding_workers is the number of processes used to ground the actions.
+        """
+        self.stats = stats
+        self.encoding = encoding
+        self.domain = PDDLParser.parse(domain_file, stats=stats)
+        self.problem = PDDLParser.parse(problem_file, stats=stats)
         self.custom_assigner = custom_assigner
 
         grounder = Grounder(self.domain, self.problem,
                             custom_assigner=custom_assigner)
-        self.task = grounder.ground()
+        self.task = grounder.ground(
+            stats=stats, relaxed_reachability=relaxed_grounding, workers=grounding_workers)
 
-    def find_plan(self, min_horizon=1, max_horizon=10):
+        self.mutexes = None
+        if mutexes:
+            with timed(stats, "mutexes"):
+                self.mutexes = get_h2_mutexes(self.task)
+            if stats is not None:
+                stats.increment("mutexes", len(self.mutexes))
+
+        self.layers = None
+        if reachability:
+            with timed(stats, "reachability"):
+                self.layers = ReachabilityLayers(self.task)
+
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = CnfCache(cache_dir, self.task, encoding=encoding,
+                                  mutexes=mutexes, reachability=reachability)
+
+    def find_plan(self, min_horizon=1, max_horizon=10, incremental=False, solver_name='minisat22',
+                  scheduler=None, timeout=None):
         '''
-        Try to find a plan for differents horizons varying between min_horizon and max_horizon
+        Try to find a plan for differents horizons varying between min_horizon and max_horizon.
+        timeout is the maximal time in seconds given to minisat for each horizon, after which
+        the horizon is considered to have no plan. It is not supported by the incremental mode.
+        If incremental is True, a single python-sat solver named solver_name is kept between
+        the horizons : the clauses of each new step are added to it and the goals are passed
+        as assumptions.
+        If a HorizonScheduler is given, several horizons are solved at the same time by
+        minisat processes, and the first plan found is returned, which is not necessarily
+        the shortest one.
         '''
-        solver = MinisatSolver()
-        plan_extractor = PlanExtractor(self.task)
-        print('looking for a plan with {} actions ...'.format(min_horizon))
-        formula = plan_extractor.encode_plan_formula(min_horizon)
+        if incremental and timeout is not None:
+            raise ValueError('timeout is not supported by the incremental mode')
+        if self.layers is not None:
+            lower_bound = self.layers.get_lower_bound()
+            if lower_bound > max_horizon:
+                print('No plan with less than {} actions exists'.format(
+                    max_horizon))
+                return []
+            min_horizon = max(min_horizon, lower_bound)
+        if self.cache is not None:
+            while min_horizon <= max_horizon and self.cache.get_result(min_horizon) == 'UNSAT':
+                print('No plan with {} actions (cached)'.format(min_horizon))
+                if self.stats is not None:
+                    self.stats.increment("skipped_horizons")
+                min_horizon += 1
+        with timed(self.stats, "search"):
+            if scheduler is not None:
+                return self._find_plan_parallel(min_horizon, max_horizon, scheduler, timeout)
+            if incremental:
+                return self._find_plan_incremental(min_horizon, max_horizon, solver_name)
+            return self._find_plan(min_horizon, max_horizon, timeout)
 
-        valuation = solver.solve(formula)
-        plan = plan_extractor.extract_plan(self.task.operators, valuation)
+    def _encode(self, encode):
+        """Calls the encoding function encode and returns the formula"""
+        with timed(self.stats, "encoding"):
+            return encode()
+
+    def _solve(self, solve):
+        """Calls the solving function solve and returns the valuation"""
+        if self.stats is not None:
+            self.stats.increment("horizons")
+        with timed(self.stats, "solving"):
+            return solve()
+
+    def _find_plan(self, min_horizon, max_horizon, timeout):
+        solver = MinisatSolver(timeout=timeout)
+        plan_extractor = PlanExtractor(
+            self.task, self.encoding, self.mutexes, self.layers)
+        plan = []
+        for horizon in range(min_horizon, max_horizon + 1):
+            print('looking for a plan with {} actions ...'.format(horizon))
+            formula = self._get_formula(plan_extractor, horizon)
+            status, valuation = self._solve(lambda: solver.solve(formula))
+            self._store_result(horizon, status)
+            plan = plan_extractor.extract_plan(valuation, horizon)
+            if plan:
+                print('Plan with {} actions found'.format(len(plan)))
+                return plan
+        print('No plan with less than {} actions found'.format(max_horizon))
+        return plan
 
-        if plan:
-            print('Plan with {} actions found'.format(min_horizon))
-            return plan
+    def _get_formula(self, plan_extractor, horizon):
+        """Returns the formula of a horizon, from the cache or from the plan extractor"""
+        if self.cache is not None:
+            formula = self.cache.load_formula(horizon)
+            if formula is not None:
+                if self.stats is not None:
+                    self.stats.increment("cached_formulas")
+                return formula
+        if plan_extractor.last_horizon == horizon - 1:
+            formula = self._encode(plan_extractor.encode_formula_next_horizon)
         else:
-            while plan_extractor.last_horizon <= max_horizon:
-                print('looking for a plan with {} actions ...'.format(
-                    plan_extractor.last_horizon+1))
-                formula = plan_extractor.encode_formula_next_horizon()
-                valuation = solver.solve(formula)
-                plan = plan_extractor.extract_plan(
-                    self.task.operators, valuation)
+            formula = self._encode(
+                lambda: plan_extractor.encode_plan_formula(horizon))
+        if self.cache is not None:
+            self.cache.store_formula(horizon, formula)
+        return formula
+
+    def _store_result(self, horizon, status):
+        """Stores in the cache whether a horizon is satisfiable, if the status is SAT or UNSAT"""
+        if self.cache is not None and status in (SAT, UNSAT):
+            self.cache.set_result(horizon, status)
+
+    def _find_plan_incremental(self, min_horizon, max_horizon, solver_name):
+        plan_extractor = PlanExtractor(
+            self.task, self.encoding, self.mutexes, self.layers)
+        with IncrementalSolver(solver_name) as solver:
+            solver.add_formula(plan_extractor.last_formula_without_goal)
+            for horizon in range(min_horizon, max_horizon + 1):
+                print('looking for a plan with {} actions ...'.format(horizon))
+                while plan_extractor.last_horizon < horizon:
+                    chunk = self._encode(plan_extractor.encode_next_step)
+                    solver.add_chunk(chunk)
+                assumptions = plan_extractor.get_goal_assumptions(horizon)
+                valuation = self._solve(lambda: solver.solve(assumptions))
+                # python-sat always decides the formula under the assumptions
+                self._store_result(horizon, SAT if valuation else UNSAT)
+                plan = plan_extractor.extract_plan(valuation)
                 if plan:
-                    print('Plan with {} actions found'.format(
-                        plan_extractor.last_horizon))
+                    print('Plan with {} actions found'.format(len(plan)))
                     return plan
         print('No plan with less than {} actions found'.format(max_horizon))
+        return []
+
+    def _get_formulas(self, plan_extractor, min_horizon, max_horizon):
+        """
+        Yields the pairs (horizon, formula) for the horizons between min_horizon and max_horizon,
+        the formulas being taken from the cache if possible
+        """
+        for horizon in range(min_horizon, max_horizon + 1):
+            yield horizon, self._get_formula(plan_extractor, horizon)
+
+    def _find_plan_parallel(self, min_horizon, max_horizon, scheduler, timeout):
+        plan_extractor = PlanExtractor(
+            self.task, self.encoding, self.mutexes, self.layers)
+        formulas = self._get_formulas(plan_extractor, min_horizon, max_horizon)
+        if self.stats is not None:
+            formulas = self._count_horizons(formulas)
+        horizon, valuation = scheduler.find_model(
+            formulas, self._store_result, timeout)
+        if horizon is None:
+            print('No plan with less than {} actions found'.format(max_horizon))
+            return []
+        plan = plan_extractor.extract_plan(valuation, horizon)
+        print('Plan with {} actions found'.format(len(plan)))
         return plan
+
+    def _count_horizons(self, formulas):
+        for horizon, formula in formulas:
+            self.stats.increment("horizons")
+            yield horizon, formula
@@ -0,0 +1,24 @@
+import os
+
+from src.sat_planner.plan_extractor import PlanExtractor
+from src.sat_planner.sat_planner import SATPlanner
+
+INSTANCES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instances')
+domain_file = os.path.join(INSTANCES, 'groupe2', 'domain.pddl')
+problem_file = os.path.join(INSTANCES, 'groupe2', 'problem0.pddl')
+
+
+def test_encodings():
+    for encoding in PlanExtractor.ENCODINGS:
+        planner = SATPlanner(domain_file, problem_file, encoding=encoding)
+        plan = planner.find_plan(min_horizon=1, max_horizon=10, incremental=True)
+        assert plan, encoding
+        assert PlanExtractor(planner.task, encoding).is_valid_plan(plan), encoding
+        if encoding not in PlanExtractor.PARALLEL_ENCODINGS:
+            # the sequential encodings find a shortest plan
+            assert len(plan) == 7, encoding
+
+
+if __name__ == '__main__':
+    test_encodings()
+    print('encodings OK')
@@ -0,0 +1,61 @@
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import json
+import time
+
+
+class Statistics:
+    """
+    Collects the statistics of a planner run :
+    - times : wall time in seconds spent in each phase (parsing, grounding,
+    heuristic_setup, search, ...), accumulated over the calls
+    - counters : counts of events (generated, expanded, evaluated nodes, ...)
+    and maxima such as the peak size of the open list
+    """
+
+    def __init__(self):
+        self.times = defaultdict(float)
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def timer(self, phase):
+        """Context manager adding the time spent in its body to a phase"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[phase] += time.perf_counter() - t0
+
+    def add_time(self, phase, seconds):
+        self.times[phase] += seconds
+
+    def increment(self, name, value=1):
+        self.counters[name] += value
+
+    def update_max(self, name, value):
+        if value > self.counters[name]:
+            self.counters[name] = value
+
+    def to_dict(self):
+        return {"times": dict(self.times), "counters": dict(self.counters)}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+    def dump(self, filename):
+        """Writes the statistics to a json file"""
+        with open(filename, 'w') as file:
+            file.write(self.to_json())
+
+    def __str__(self):
+        return self.to_json()
+
+
+def timed(stats, phase):
+    """
+    Returns a context manager timing a phase in stats,
+    which does nothing if stats is None
+    """
+    if stats is None:
+        return nullcontext()
+    return stats.timer(phase)
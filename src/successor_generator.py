@@ -0,0 +1,137 @@
+from collections import defaultdict
+
+
+class SuccessorNode:
+    """
+    A node of the successor generator decision tree.
+    - operators : operators whose positive preconditions have all been tested
+    on the path from the root to this node
+    - checked_operators : same, but with negative preconditions which still
+    have to be checked against the state
+    - children : dictionnary key -> child node, where the operators of the
+    child all require the fact represented by key
+    - keys : the keys of the children, in a form which can be intersected with a state
+    """
+
+    __slots__ = ("operators", "checked_operators", "children", "keys")
+
+    def __init__(self):
+        self.operators = []
+        self.checked_operators = []
+        self.children = {}
+        self.keys = None
+
+
+class SuccessorGenerator:
+    """
+    A decision tree over the preconditions of the operators, in the spirit
+    of Fast Downward's successor generator. It is built once from the operators
+    of a task and returns the operators applicable in a state while only
+    visiting the branches whose facts are true in the state.
+
+    The positive preconditions of each operator are sorted and operators are grouped
+    by their first precondition, then by their second one inside each group, etc.
+    """
+
+    def __init__(self, operators):
+        self.root = self._build(operators)
+
+    def _get_preconditions(self, op):
+        """Returns the sorted keys of the positive preconditions of an operator"""
+        return tuple(sorted(op.pos_preconditions))
+
+    def _has_neg_preconditions(self, op):
+        return bool(op.neg_preconditions)
+
+    def _get_keys(self, children):
+        """Returns the keys of the children of a node"""
+        return frozenset(children)
+
+    def _get_true_keys(self, state, keys):
+        """Returns the keys of a node whose facts are true in the state"""
+        return keys.intersection(state)
+
+    def _build(self, operators):
+        """
+        Build the tree iteratively : each entry of the stack is a node,
+        the operators to store below it and the number of preconditions
+        already tested on the path to the node.
+        """
+        root = SuccessorNode()
+        entries = [(op, self._get_preconditions(op)) for op in operators]
+        stack = [(root, entries, 0)]
+        while stack:
+            node, entries, depth = stack.pop()
+            groups = defaultdict(list)
+            for op, preconditions in entries:
+                if len(preconditions) == depth:
+                    if self._has_neg_preconditions(op):
+                        node.checked_operators.append(op)
+                    else:
+                        node.operators.append(op)
+                else:
+                    groups[preconditions[depth]].append((op, preconditions))
+            for key, group in groups.items():
+                child = SuccessorNode()
+                node.children[key] = child
+                stack.append((child, group, depth + 1))
+            node.keys = self._get_keys(node.children)
+        return root
+
+    def get_applicable_operators(self, state):
+        """
+        Returns the list of operators applicable in a state
+        """
+        applicable_operators = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            applicable_operators.extend(node.operators)
+            for op in node.checked_operators:
+                if op.applicable(state):
+                    applicable_operators.append(op)
+            if node.children:
+                children = node.children
+                stack.extend(children[key]
+                             for key in self._get_true_keys(state, node.keys))
+        return applicable_operators
+
+    def get_next_states(self, state):
+        """
+        Returns a list of (op, new_state) pairs where "op" is an applicable
+        operator and "new_state" is the state obtained after applying op in state
+        """
+        return [(op, op.apply(state)) for op in self.get_applicable_operators(state)]
+
+
+class BitsetSuccessorGenerator(SuccessorGenerator):
+    """
+    A successor generator for compiled operators, where states are bitsets.
+    The keys of the tree are single bit masks, and the keys of a node are stored
+    as the union of these masks.
+    """
+
+    def _get_preconditions(self, op):
+        preconditions = []
+        mask = op.pre_mask
+        while mask:
+            lowest_bit = mask & -mask
+            preconditions.append(lowest_bit)
+            mask ^= lowest_bit
+        return tuple(preconditions)
+
+    def _has_neg_preconditions(self, op):
+        return bool(op.neg_mask)
+
+    def _get_keys(self, children):
+        mask = 0
+        for key in children:
+            mask |= key
+        return mask
+
+    def _get_true_keys(self, state, keys):
+        true_keys = state & keys
+        while true_keys:
+            lowest_bit = true_keys & -true_keys
+            yield lowest_bit
+            true_keys ^= lowest_bit
@@ -0,0 +1,30 @@
+import os
+
+from src.grounder import Grounder
+import src.pddlparser as pddlparser
+
+INSTANCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instances')
+domain_file = os.path.join(INSTANCES, 'groupe1', 'domain.pddl')
+problem_file = os.path.join(INSTANCES, 'groupe1', 'problem1.pddl')
+
+
+def ground(**options):
+    """Grounds the task and returns a comparable representation of it"""
+    domain = pddlparser.PDDLParser.parse(domain_file)
+    problem = pddlparser.PDDLParser.parse(problem_file)
+    task = Grounder(domain, problem).ground(**options)
+    operators = sorted((op.name, sorted(op.pos_preconditions), sorted(op.neg_preconditions),
+                        sorted(op.add_effects), sorted(op.del_effects)) for op in task.operators)
+    return sorted(task.facts), sorted(task.initial_state), sorted(task.goals), operators
+
+
+def test_grounding_modes():
+    task = ground()
+    assert task[3]
+    assert ground(relaxed_reachability=True) == task
+    assert ground(workers=2) == task
+
+
+if __name__ == '__main__':
+    test_grounding_modes()
+    print('grounding OK')